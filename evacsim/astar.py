@@ -1,6 +1,9 @@
+from array import array
+from heapq import heappop, heappush
 from typing import Callable, Dict, List, Set
 from pqdict import pqdict
 
+from .graph.grid_graph import GridGraph
 from .graph.interface import Graph, Node
 
 
@@ -47,3 +50,74 @@ class AStar:
             path.append(self.predecessors[path[-1]])
         path.reverse()
         return path
+
+
+UNKNOWN = -1
+
+
+class GridAStar:
+    """A* on the cells of a GridGraph with the Manhattan distance heuristic
+
+    Unlike AStar, nodes are plain cell IDs and the search's state is kept in
+    flat arrays indexed by them. Nodes whose cost improves are pushed onto
+    the heap again and their stale entries are skipped when popped. Among
+    nodes with the same f-cost, the ones closer to the goal are expanded
+    first.
+
+    Like with AStar, the goal can be changed and the search resumed.
+    """
+
+    def __init__(self, grid: GridGraph, start: int, goal: int):
+        self.grid = grid
+        self.start = start
+        self.goal = goal
+        self.g_costs = array("l", [UNKNOWN]) * grid.size
+        self.predecessors = array("l", [UNKNOWN]) * grid.size
+        self.closed = bytearray(grid.size)
+        self.g_costs[start] = 0
+        # Number of nodes with a known g-cost
+        self.explored = 1
+        h = self.heuristic(start)
+        self.opened = [(h, h, start)]
+
+    def heuristic(self, n: int) -> int:
+        n_row, n_col = divmod(n, self.grid.cols)
+        goal_row, goal_col = divmod(self.goal, self.grid.cols)
+        return abs(n_row - goal_row) + abs(n_col - goal_col)
+
+    def pathfind(self) -> bool:
+        opened, closed = self.opened, self.closed
+        g_costs, predecessors = self.g_costs, self.predecessors
+        adjacent = self.grid.adjacent
+        cols = self.grid.cols
+        goal = self.goal
+        goal_row, goal_col = divmod(goal, cols)
+        while opened:
+            curr = heappop(opened)[2]
+            if closed[curr]:
+                continue
+            closed[curr] = 1
+            considered_g_cost = g_costs[curr] + 1
+            for n in adjacent(curr):
+                if closed[n]:
+                    continue
+                g_cost = g_costs[n]
+                if g_cost == UNKNOWN:
+                    self.explored += 1
+                elif considered_g_cost >= g_cost:
+                    continue
+                g_costs[n] = considered_g_cost
+                predecessors[n] = curr
+                row, col = divmod(n, cols)
+                h = abs(row - goal_row) + abs(col - goal_col)
+                heappush(opened, (considered_g_cost + h, h, n))
+            if curr == goal:
+                return True
+        return False
+
+    def reconstruct_path(self) -> List[int]:
+        path = [self.goal]
+        while self.predecessors[path[-1]] != UNKNOWN:
+            path.append(self.predecessors[path[-1]])
+        path.reverse()
+        return path
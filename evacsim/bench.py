@@ -13,7 +13,7 @@ from pathlib import Path
 from pprint import pformat
 from sys import stderr
 from time import process_time_ns
-from typing import Any, Dict, List, Tuple, Optional
+from typing import Any, Dict, List, Sequence, Tuple, Optional
 from dataclasses import dataclass
 import numpy as np
 
@@ -29,12 +29,12 @@ class BenchResult():
     agent_counts: Dict[AgentType, int]
     makespans: Dict[AgentType, int]
     safe_ratios: Dict[AgentType, List[float]]
-    paths: List[List[int]]
+    paths: Sequence[Sequence[int]]
     planning_time: float
     expansion_time: Optional[float] = None
     expansion_makespan: Optional[int] = None
 
-    def __init__(self, level: Level, paths: List[List[int]], time: int):
+    def __init__(self, level: Level, paths: Sequence[Sequence[int]], time: int):
         """Create a new BenchResult
 
         Uses the given arguments to create a new BenchResult with most
@@ -7,25 +7,35 @@ which can be use to call the different commands and set their properties.
 This CLI replaces `__main__.py` files scattered around the project with
 a single, unified interface for running everything.
 """
-from typing import List, Set
+from typing import List, Sequence, Set
+import os
 import pathlib as pl
+from pprint import pformat
 from sys import stderr
+from time import monotonic
 
 import click
 
 import evacsim.bench as bench
 import evacsim.expansion as expansion
 import evacsim.lcmae as lcmae
+import evacsim.microbench as microbench
 import evacsim.plots as plots
-from .level import Level
+from .level import Level, CACHE_DIR_ENV
 # grid is imported only when it's required for the application to work.
 # That's because GitLab CI doesn't have OpenGL libraries installed and
 # will fail if we try to import arcade, even indirectly.
 
 
 @click.group()
-def cli():
-    pass
+@click.option("--cache-dir",
+              type=click.Path(file_okay=False),
+              envvar=CACHE_DIR_ENV,
+              help="Directory in which compiled maps and scenarios are cached")
+def cli(cache_dir):
+    if cache_dir:
+        # Passed on through the environment, so that benchmark workers use it too
+        os.environ[CACHE_DIR_ENV] = cache_dir
 
 
 @cli.command()
@@ -39,19 +49,107 @@ def cli():
 @click.option("--debug/--no-debug",
               default=False,
               help="Print planning algorithm's debug output")
+@click.option("--trace",
+              type=click.File("w"),
+              help="File into which LC-MAE writes its agents' decisions, as JSON lines")
+@click.option("--trace-level",
+              type=click.Choice(tuple(lcmae.TRACE_LEVELS)),
+              default="debug",
+              help="Least important level of the decisions written with --trace")
+@click.option("--sleep-radius",
+              type=click.INT,
+              default=40,
+              help="Distance from endangered agents beyond which LC-MAE lets safe agents sleep (0 keeps them awake)")
+@click.option("--workers",
+              type=click.INT,
+              default=1,
+              help="Number of processes LC-MAE plans in, splitting the map between them (1 plans serially)")
+@click.option("--stream/--no-stream",
+              default=False,
+              help="Print LC-MAE's plan while planning, one line with all agents' positions per timestep")
+@click.option("--time-budget",
+              type=click.FLOAT,
+              help="Seconds after which LC-MAE stops and outputs the plan made so far")
+@click.option("--portfolio",
+              type=click.INT,
+              default=1,
+              help="Number of random seeds LC-MAE plans with in parallel, keeping the best plan")
+@click.option("--portfolio-criterion",
+              type=click.Choice(lcmae.PORTFOLIO_CRITERIA),
+              default="makespan",
+              help="What the best plan of the portfolio has: the shortest makespan or 95th percentile of safety times")
+@click.option("--portfolio-target",
+              type=click.FLOAT,
+              help="Stop the portfolio once a plan reaches this value of the criterion")
+@click.option("--resume",
+              type=click.Path(exists=True, dir_okay=False),
+              help="Plan made earlier, which LC-MAE continues instead of starting from the scenario's origins")
+@click.option("--resume-at",
+              type=click.INT,
+              help="Timestep of the --resume plan from which LC-MAE plans anew (the last one by default)")
 @click.argument("map_path",
                 type=click.Path(exists=True, dir_okay=False))
 @click.argument("scenario_path",
                 type=click.Path(exists=True, dir_okay=False))
-def plan(map_path, scenario_path, algorithm, visualize, debug):
-    "Create an evacuation plan for a map and a scenario"
+def plan(map_path, scenario_path, algorithm, visualize, debug, trace, trace_level, sleep_radius, workers, stream,
+         time_budget, portfolio, portfolio_criterion, portfolio_target, resume, resume_at):
+    """Create an evacuation plan for a map and a scenario
+
+    When LC-MAE runs out of the time budget, the agents which are still
+    endangered are listed on the standard error output, with their
+    distances from safety.
+
+    A plan resumed with --resume is kept up to the --resume-at timestep and
+    planned anew from there. The scenario may have more danger and more
+    agents than the one the plan was made for. The added agents join in
+    that timestep and their paths hold -1 before it.
+    """
+    if stream and (algorithm != "lcmae" or workers > 1 or visualize):
+        raise click.UsageError("--stream only works with single-process LC-MAE and without --visualize")
+    if time_budget is not None and (algorithm != "lcmae" or workers > 1 or stream):
+        raise click.UsageError("--time-budget only works with single-process LC-MAE and without --stream")
+    if portfolio > 1 and (algorithm != "lcmae" or workers > 1 or stream or time_budget is not None):
+        raise click.UsageError("--portfolio only works with LC-MAE, without --workers, --stream and --time-budget")
+    if trace is not None and (algorithm != "lcmae" or workers > 1 or portfolio > 1):
+        raise click.UsageError("--trace only works with single-process LC-MAE and without --portfolio")
+    if resume is not None and (algorithm != "lcmae" or workers > 1 or stream or portfolio > 1):
+        raise click.UsageError("--resume only works with single-process LC-MAE, without --stream and --portfolio")
+    tracer = lcmae.Tracer(trace, lcmae.TRACE_LEVELS[trace_level]) if trace is not None else None
+    # The budget includes loading the level
+    deadline = monotonic() + time_budget if time_budget is not None else None
     lvl = Level(map_path, scenario_path)
     if not lvl.frontier:
         print("No passage to safety exists!", file=stderr)
         exit(2)
-    paths: List[List[int]] = []
-    if algorithm == "lcmae":
-        paths = lcmae.plan_evacuation(lvl, debug=debug)
+    if stream:
+        for positions in lcmae.stream_evacuation(lvl, debug=debug, sleep_radius=sleep_radius or None,
+                                                 tracer=tracer):
+            print(" ".join("{:02d}".format(n) for n in positions), flush=True)
+        return
+    paths: Sequence[Sequence[int]] = []
+    if algorithm == "lcmae" and workers > 1:
+        paths = lcmae.plan_evacuation_parallel(lvl, workers, debug=debug)
+    elif algorithm == "lcmae" and portfolio > 1:
+        best = lcmae.plan_evacuation_portfolio(lvl, portfolio, portfolio_criterion, portfolio_target,
+                                               sleep_radius=sleep_radius or None)
+        print(f"Best plan found with seed {best.seed}, {portfolio_criterion} {best.score}", file=stderr)
+        paths = best.paths
+    elif algorithm == "lcmae" and (deadline is not None or resume is not None):
+        prefix = None
+        if resume is not None:
+            previous = parse_paths(resume)
+            end = resume_at + 1 if resume_at is not None else None
+            prefix = [path[:end] for path in previous]
+        planner = lcmae.AnytimePlanner(lvl, debug=debug, sleep_radius=sleep_radius or None, tracer=tracer,
+                                       prefix=prefix)
+        partial = planner.plan(deadline=deadline)
+        paths = partial.paths
+        if not partial.finished:
+            print(f"Time budget ran out with {len(partial.endangered)} agents still endangered", file=stderr)
+            for agent, distance in sorted(partial.endangered.items()):
+                print(f"agent {agent}: {'unreachable' if distance is None else distance} from safety", file=stderr)
+    elif algorithm == "lcmae":
+        paths = lcmae.plan_evacuation(lvl, debug=debug, sleep_radius=sleep_radius or None, tracer=tracer)
     else:
         paths = expansion.plan_evacuation(lvl,
                                           postprocess=(algorithm == "postmae"),
@@ -110,6 +208,18 @@ def benchmark(benchfile, processes, format, flow, plot_dest, path_dest):
             write_paths(path.joinpath(f"{name}.out"), result.paths)
 
 
+@cli.command(name="microbench")
+@click.argument("name", type=click.Choice(tuple(microbench.BENCHMARKS)))
+@click.argument("map_path",
+                type=click.Path(exists=True, dir_okay=False))
+@click.argument("scenario_path",
+                type=click.Path(exists=True, dir_okay=False))
+def microbench_cmd(name, map_path, scenario_path):
+    """Time an isolated part of the planners on a map and scenario"""
+    lvl = Level(map_path, scenario_path)
+    print(pformat(microbench.BENCHMARKS[name](lvl)))
+
+
 @cli.command()
 @click.option("-s", "--square-size",
               default=15,
@@ -150,7 +260,7 @@ def check(map_path, scenario_path, solution_path):
     check_paths(paths, level)
 
 
-def paths_to_str(paths: List[List[int]]) -> str:
+def paths_to_str(paths: Sequence[Sequence[int]]) -> str:
     """Create a string with given paths printed in a readable format"""
     lines = []
     for path in paths:
@@ -159,7 +269,7 @@ def paths_to_str(paths: List[List[int]]) -> str:
     return "\n".join(lines)
 
 
-def write_paths(filename: str, paths: List[List[int]]):
+def write_paths(filename: str, paths: Sequence[Sequence[int]]):
     """Write the given agent paths into a file, in the format used by all the tools"""
     with open(filename, "w") as f:
         print(paths_to_str(paths), file=f)
@@ -196,7 +306,7 @@ def check_paths(paths: List[List[int]], level: Level):
         if level.scenario.agents[agent].origin != p[0]:
             print("Agent starts at a point different from the scenario")
         for i in range(1, len(p)):
-            if p[i - 1] not in level.g[p[i]] and p[i - 1] != p[i]:
+            if p[i - 1] not in level.grid.adjacent(p[i]) and p[i - 1] != p[i]:
                 print(f"Non-adjacent movement of agent {agent} at time {i}")
 
 
@@ -26,8 +26,8 @@ class _NodeAdder:
         self.next_id += 1
         return curr_id
 
-    def node_clones(self, g: nx.Graph, label=None) -> Dict[int, int]:
-        return {n: self.add(label=f"{n}-{label}") for n in g.node}
+    def node_clones(self, nodes: List[int], label=None) -> Dict[int, int]:
+        return {n: self.add(label=f"{n}-{label}") for n in nodes}
 
 
 class NodeInfo(NamedTuple):
@@ -56,21 +56,23 @@ def expand(lvl: Level, time: int) -> Tuple[nx.DiGraph, List[Tuple[Dict[int, int]
     adder = _NodeAdder(exp_g)
     source = adder.add("src")
     sink = adder.add("sink")
-    inputs = adder.node_clones(lvl.g, "0i")
+    nodes = lvl.grid.nodes().tolist()
+    edges = lvl.grid.edges().tolist()
+    inputs = adder.node_clones(nodes, "0i")
     node_id_records = []
     outputs: Dict[int, int] = {}
     for agent in lvl.scenario.agents:
         exp_g.add_edge(source, inputs[agent.origin], capacity=1)
     for t in range(0, time):
-        outputs = adder.node_clones(lvl.g, f"{t}o")
+        outputs = adder.node_clones(nodes, f"{t}o")
         for k in inputs:
             exp_g.add_edge(inputs[k], outputs[k], capacity=1)
         node_id_records.append((inputs, outputs))
         if t < time - 1:
-            inputs = adder.node_clones(lvl.g, f"{t+1}i")
+            inputs = adder.node_clones(nodes, f"{t+1}i")
             for k in inputs:
                 exp_g.add_edge(outputs[k], inputs[k], capacity=1)
-            for edge in lvl.g.edges:
+            for edge in edges:
                 exp_g.add_edge(outputs[edge[0]], inputs[edge[1]], capacity=1)
                 exp_g.add_edge(outputs[edge[1]], inputs[edge[0]], capacity=1)
         else:
@@ -189,12 +191,13 @@ class FlowAgent():
 
 def postprocess_iteration(lvl: Level, paths: List[List[int]], debug: bool) -> List[List[int]]:
     """Makes agents trying to move into occupied vertices wait for another turn and resolve deadlocks."""
-    reservations = ReservationGraph(lvl.g)
+    reservations = ReservationGraph(lvl.grid)
     agents: List[FlowAgent] = []
     for i, path in enumerate(paths):
         agents.append(FlowAgent(lvl, reservations, agents, i, path, debug))
     i = 0
     while any(map(lambda a: not a.done(), agents)):
+        reservations.expire(min(len(agent.path) for agent in agents))
         for agent in agents:
             agent.step()
     return [agent.path for agent in agents]
@@ -0,0 +1,195 @@
+from heapq import heapify, heappop, heappush
+from typing import Dict, List, Sequence, Set, Tuple
+import networkx as nx
+import numpy as np
+
+from .interface import Graph
+from .nx_graph import NxNode
+
+
+class GridGraph(Graph[NxNode]):
+    """A compiled graph of a level's grid.
+
+    Nodes are the IDs of the grid's cells (`row * cols + col`), so that they
+    can directly index all of the per-cell arrays. Neighbors are stored in
+    CSR form: the neighbors of cell `n` are `indices[indptr[n]:indptr[n + 1]]`,
+    in the up, left, down, right order. Walls have no neighbors and are not
+    `passable`. Only the danger can change, see add_danger().
+    """
+
+    def __init__(self, rows: int, cols: int, indptr: np.ndarray, indices: np.ndarray,
+                 passable: np.ndarray, dangerous: np.ndarray):
+        self.rows = rows
+        self.cols = cols
+        self.size = rows * cols
+        self.indptr = indptr
+        self.indices = indices
+        self.passable = passable
+        self.dangerous = dangerous & passable
+        self.row_of, self.col_of = np.divmod(np.arange(self.size, dtype=np.int32), np.int32(cols))
+        for a in (self.indptr, self.indices, self.passable, self.dangerous, self.row_of, self.col_of):
+            a.setflags(write=False)
+        self._dangerous = memoryview(self.dangerous)
+        # Tuples of neighbors for the scalar code, created on first use
+        self._adjacent: Dict[int, Tuple[int, ...]] = {}
+        self._nx_view = None
+
+    @staticmethod
+    def from_passable(rows: int, cols: int, passable: np.ndarray, dangerous: np.ndarray):
+        """Compile a 4-connected graph from a mask of the passable cells"""
+        indptr, indices = GridGraph.link(rows, cols, passable)
+        return GridGraph(rows, cols, indptr, indices, passable.reshape(-1), dangerous)
+
+    @staticmethod
+    def link(rows: int, cols: int, passable: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the CSR neighbor arrays (indptr, indices) of the passable cells
+
+        Instead of visiting the cells one by one, the neighbors of all cells
+        in each direction are found at once by shifting the mask.
+        """
+        grid = passable.reshape(rows, cols)
+        # One flag per direction, in the up, left, down, right order
+        linked = np.zeros((rows, cols, 4), dtype=bool)
+        linked[1:, :, 0] = grid[1:] & grid[:-1]
+        linked[:, 1:, 1] = grid[:, 1:] & grid[:, :-1]
+        linked[:-1, :, 2] = grid[:-1] & grid[1:]
+        linked[:, :-1, 3] = grid[:, :-1] & grid[:, 1:]
+        edges = np.flatnonzero(linked)
+        sources = edges >> 2
+        indices = (sources + np.array([-cols, -1, cols, 1])[edges & 3]).astype(np.int32)
+        indptr = np.zeros(rows * cols + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=rows * cols), out=indptr[1:])
+        return indptr, indices
+
+    def adjacent(self, pos: int) -> Tuple[int, ...]:
+        """Return the IDs of cells neighboring the given one"""
+        neighbors = self._adjacent.get(pos)
+        if neighbors is None:
+            neighbors = tuple(self.indices[self.indptr[pos]:self.indptr[pos + 1]].tolist())
+            self._adjacent[pos] = neighbors
+        return neighbors
+
+    def neighbors(self, node: NxNode) -> List[NxNode]:
+        return [NxNode(k) for k in self.adjacent(node)]
+
+    def add_danger(self, cells: np.ndarray) -> np.ndarray:
+        """Mark the given cells as dangerous and return those of them which weren't dangerous before
+
+        Walls never become dangerous. The mask is replaced by an updated
+        copy, so that arrays memory-mapped from a cache or shared with other
+        processes are never written to.
+        """
+        cells = np.unique(np.asarray(cells, dtype=np.int64))
+        cells = cells[(cells >= 0) & (cells < self.size)]
+        cells = cells[self.passable[cells] & ~self.dangerous[cells]]
+        if cells.size:
+            dangerous = self.dangerous.copy()
+            dangerous[cells] = True
+            dangerous.setflags(write=False)
+            self.dangerous = dangerous
+            self._dangerous = memoryview(dangerous)
+            self._nx_view = None
+        return cells
+
+    def is_dangerous(self, pos: int) -> bool:
+        return self._dangerous[pos]
+
+    def nodes(self) -> np.ndarray:
+        """Return the IDs of all passable cells"""
+        return np.flatnonzero(self.passable)
+
+    def edges(self) -> np.ndarray:
+        """Return an array of (u, v) rows, one for each edge, with u < v"""
+        sources = np.repeat(np.arange(self.size, dtype=np.int32), np.diff(self.indptr))
+        forward = sources < self.indices
+        return np.stack((sources[forward], self.indices[forward]), axis=1)
+
+    def bfs(self, sources: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Run a breadth-first search from all of the sources at once
+
+        Return the distance of every cell from the nearest source and that
+        source's ID (its label). Both are -1 for cells which can't be reached.
+        Each layer of the search is expanded at once, and a cell reached from
+        more parents gets the label of the parent with the lowest ID.
+        """
+        distances = np.full(self.size, -1, dtype=np.int32)
+        labels = np.full(self.size, -1, dtype=np.int32)
+        layer = np.unique(np.asarray(sources, dtype=np.int64))
+        distances[layer] = 0
+        labels[layer] = layer
+        depth = 0
+        while layer.size:
+            depth += 1
+            starts = self.indptr[layer]
+            degrees = self.indptr[layer + 1] - starts
+            # Positions of all the layer's neighbors in `indices`
+            first = np.repeat(np.cumsum(degrees) - degrees, degrees)
+            edges = np.repeat(starts, degrees) + np.arange(first.size) - first
+            neighbors = self.indices[edges]
+            parents = np.repeat(layer, degrees)
+            unseen = distances[neighbors] < 0
+            layer, found = np.unique(neighbors[unseen], return_index=True)
+            distances[layer] = depth
+            labels[layer] = labels[parents[unseen][found]]
+        return distances, labels
+
+    def repair_bfs(self, distances: np.ndarray, labels: np.ndarray, removed: Sequence[int],
+                   added: Sequence[int]) -> np.ndarray:
+        """Update the result of bfs() in place after the given sources were removed and added
+
+        Only the cells labeled by removed sources and those which get closer
+        to an added source are searched again, so the work is proportional
+        to the part of the field that changes, not to the grid. Return the
+        cells whose distance or label changed. At equal distances, cells
+        get the lowest label, which can break ties differently than bfs().
+        """
+        dist = memoryview(distances)
+        label = memoryview(labels)
+        changed: Set[int] = set()
+        invalid: List[int] = []
+        if len(removed):
+            invalid = np.flatnonzero(np.isin(labels, np.asarray(removed, dtype=np.int64))).tolist()
+            distances[invalid] = -1
+            labels[invalid] = -1
+            changed.update(invalid)
+        queue: List[Tuple[int, int, int]] = []
+        for pos in added:
+            if dist[pos] != 0:
+                dist[pos] = 0
+                label[pos] = pos
+                changed.add(pos)
+                queue.append((0, pos, pos))
+        # The invalidated region is entered again from its intact border
+        for pos in invalid:
+            for n in self.adjacent(pos):
+                if dist[n] >= 0:
+                    queue.append((dist[n], label[n], n))
+        heapify(queue)
+        while queue:
+            d, source, pos = heappop(queue)
+            if dist[pos] != d or label[pos] != source:
+                continue
+            d += 1
+            for n in self.adjacent(pos):
+                if dist[n] < 0 or d < dist[n]:
+                    dist[n] = d
+                    label[n] = source
+                    changed.add(n)
+                    heappush(queue, (d, source, n))
+        return np.fromiter(changed, dtype=np.int64, count=len(changed))
+
+    def as_networkx(self) -> nx.Graph:
+        """Return a networkx view of the graph, for code which needs one
+
+        The view is built on first use and shared afterwards, so it should not
+        be modified.
+        """
+        if self._nx_view is None:
+            g = nx.Graph()
+            g.graph["rows"] = self.rows
+            g.graph["cols"] = self.cols
+            for n in self.nodes().tolist():
+                g.add_node(n, dangerous=self.is_dangerous(n))
+            g.add_edges_from(self.edges().tolist())
+            self._nx_view = g
+        return self._nx_view
@@ -5,6 +5,8 @@ N = TypeVar("N")
 
 
 class Node(ABC):
+    __slots__ = ()
+
     @abstractmethod
     def id(self) -> int:
         raise NotImplementedError()
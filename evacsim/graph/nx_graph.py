@@ -3,15 +3,18 @@ import networkx as nx
 from typing import List
 
 
-class NxNode(Node):
-    def __init__(self, id: int):
-        self._id = id
+class NxNode(int, Node):
+    """A node of the level graph, which is just its integer ID
+
+    Subclassing int makes it cheap to create, hash and compare.
+    """
+    __slots__ = ()
 
     def id(self) -> int:
-        return self._id
+        return int(self)
 
     def pos(self) -> int:
-        return self._id
+        return int(self)
 
 
 class NxGraph(Graph[NxNode]):
@@ -19,4 +22,4 @@ class NxGraph(Graph[NxNode]):
         self.g = g
 
     def neighbors(self, node: NxNode) -> List[NxNode]:
-        return [NxNode(k) for k in self.g[node.id()].keys()]
+        return [NxNode(k) for k in self.g[node]]
@@ -1,23 +1,34 @@
 from __future__ import annotations
-from typing import Optional
-import networkx as nx
+from array import array
+from collections import defaultdict, namedtuple
+from itertools import chain
+import mmap
+from typing import DefaultDict, Iterable, List, Optional, Sequence, Set, Tuple
+import numpy as np
 
+from .grid_graph import GridGraph
 from .interface import Node
 
 
-class ReservationNode(Node):
-    def __init__(self, orig_id: int, t: int):
-        self._pos = orig_id
-        self.t = t
+class ReservationNode(namedtuple("SpacetimeKey", ("position", "t")), Node):
+    """A (position, time) pair identifying a node of the spacetime graph
+
+    Since it's a plain tuple underneath, it's hashed and compared in C and
+    keys stay distinct for any time horizon.
+    """
+    __slots__ = ()
+
+    def __new__(cls, orig_id: int, t: int):
+        return tuple.__new__(cls, (orig_id, t))
 
     def id(self) -> int:
-        return self._pos * 10000 + self.t
+        return (self.t << 32) | self.position
 
     def pos(self) -> int:
-        return self._pos
+        return self.position
 
     def incremented_t(self, delta=1) -> ReservationNode:
-        return ReservationNode(self.pos(), self.t + delta)
+        return ReservationNode(self.position, self.t + delta)
 
 
 class Reservation:
@@ -27,17 +38,137 @@ class Reservation:
         self.priority = priority
 
 
+NO_AGENT = -1
+
+
 class ReservationGraph():
-    def __init__(self, underlying_graph: nx.Graph):
-        self.g = underlying_graph
-        for n in self.g.nodes:
-            self.g.nodes[n]["reservations"] = dict()
+    """A spacetime reservation table backed by NumPy arrays.
+
+    Reservations are kept in two planes (owning agent and priority) of shape
+    `[horizon, nodes]`, where a timestep `t` is stored in row `t % horizon`.
+    Each row remembers which timestep it currently holds. Timesteps before
+    the one passed to `expire()` are dropped and their rows are recycled for
+    new timesteps. When more than `horizon` live timesteps are reserved at
+    once, the ring grows.
+
+    For every agent, the table also remembers the keys (`t * size + pos`) of
+    the cells it has reserved, so that they can be released without knowing
+    which path they came from. The index is updated lazily: keys of cells
+    taken over or cancelled in the meantime are only dropped on release.
+
+    Whenever a reservation overwrites another agent's one, that agent is
+    marked as invalidated, so that recheck_path() only needs to look at the
+    paths of invalidated agents.
+
+    Agents can also hold a standing reservation of a single cell for all
+    timesteps from some point on. It's written into every row as the row
+    starts holding a timestep, so it costs nothing to look up.
+    """
+
+    def __init__(self, grid: GridGraph, horizon=16):
+        self.grid = grid
+        self.size = grid.size
+        # All reservations before this timestep have been dropped
+        self.floor = 0
+        self._held_by: DefaultDict[int, Set[int]] = defaultdict(set)
+        # Agents some of whose reservations were overwritten by someone else
+        self._invalidated: Set[int] = set()
+        # Standing reservations, indexed by agent, with -1 for agents without one
+        self._standing_pos = np.full(0, -1, dtype=np.int64)
+        self._standing_since = np.zeros(0, dtype=np.int64)
+        self._standing_priority = np.zeros(0, dtype=np.int8)
+        self._standing_count = 0
+        self._allocate(horizon)
+
+    def _allocate(self, horizon: int):
+        self.horizon = horizon
+        self.owners, self.priorities, self._times = self._planes(horizon)
+        # Memoryviews of the flattened planes give much cheaper scalar access
+        # than indexing the NumPy arrays directly
+        self._owners = memoryview(self.owners.reshape(-1))
+        self._priorities = memoryview(self.priorities.reshape(-1))
+        # Flat views for the batch operations
+        self._flat_owners = self.owners.reshape(-1)
+        self._flat_priorities = self.priorities.reshape(-1)
+        self._row_times = np.frombuffer(self._times, dtype=np.int64)
+
+    def _planes(self, horizon: int):
+        """Return new owner and priority planes and row times for the given horizon"""
+        owners = np.full((horizon, self.size), NO_AGENT, dtype=np.int32)
+        priorities = np.zeros((horizon, self.size), dtype=np.int8)
+        return owners, priorities, array("q", [-1]) * horizon
+
+    def _row_for(self, t: int) -> int:
+        """Return the row holding timestep `t`, taking a free row or growing the ring if needed"""
+        row = t % self.horizon
+        held = self._times[row]
+        if held == t:
+            return row
+        if held >= self.floor:
+            self._grow(2 * self.horizon)
+            return self._row_for(t)
+        # Expired rows have already been cleared by expire()
+        self._times[row] = t
+        if self._standing_count:
+            self._fill_standing(row, t)
+        return row
+
+    def _grow(self, horizon: int):
+        owners, priorities, times = self.owners, self.priorities, self._times
+        self._owners.release()
+        self._priorities.release()
+        self._allocate(horizon)
+        for row, t in enumerate(times):
+            if t < 0:
+                continue
+            self.owners[t % horizon] = owners[row]
+            self.priorities[t % horizon] = priorities[row]
+            self._times[t % horizon] = t
 
     def get(self, n: ReservationNode) -> Optional[Reservation]:
-        return self.g.nodes[n.pos()]["reservations"].get(n.t)
+        t = n.t
+        row = t % self.horizon
+        if self._times[row] != t:
+            return None
+        i = row * self.size + n.position
+        agent = self._owners[i]
+        if agent == NO_AGENT:
+            return None
+        return Reservation(n, agent, self._priorities[i])
+
+    def reservable_by(self, pos: int, t: int, agent: int, priority: int) -> bool:
+        """Check whether the agent with the given reservation priority can reserve `pos` at `t`"""
+        row = t % self.horizon
+        if self._times[row] != t:
+            return True
+        i = row * self.size + pos
+        owner = self._owners[i]
+        return owner == NO_AGENT or owner == agent or self._priorities[i] < priority
+
+    def expire(self, t: int):
+        """Drop all reservations for timesteps before `t`
+
+        Nobody can take part in an already expired timestep, so reservations
+        for it are silently ignored.
+        """
+        if t <= self.floor:
+            return
+        expired = [row for row, held in enumerate(self._times) if 0 <= held < t]
+        self.owners[expired] = NO_AGENT
+        for row in expired:
+            self._times[row] = -1
+        self.floor = t
 
     def reserve(self, r: Reservation):
-        self.g.nodes[r.node.pos()]["reservations"][r.node.t] = r
+        if r.node.t < self.floor:
+            return
+        i = self._row_for(r.node.t) * self.size + r.node.position
+        owner = self._owners[i]
+        if owner != NO_AGENT and owner != r.agent:
+            self._invalidated.add(owner)
+        self._owners[i] = r.agent
+        self._priorities[i] = r.priority
+        self._held_by[r.agent].add(r.node.t * self.size + r.node.position)
 
     def cancel_reservation(self, n: ReservationNode):
         # We cannot be sure cancelled reservation will exist
@@ -45,4 +176,208 @@ class ReservationGraph():
         # both t and t+1 and so if they're staying in the
         # same node at both t and t+1, they'll try to cancel
         # the reservation for t+1 twice
-        self.g.nodes[n.pos()]["reservations"].pop(n.t, None)
+        row = n.t % self.horizon
+        if self._times[row] == n.t:
+            self._owners[row * self.size + n.position] = NO_AGENT
+
+    def reserve_path(self, nodes: Iterable[ReservationNode], agent: int, priorities: Sequence[int]):
+        """Reserve the given nodes and their t+1 twins with the given per-node priorities"""
+        pos, ts = _with_twins(nodes)
+        prios = np.repeat(np.asarray(priorities, dtype=np.int8), 2)
+        if ts.size and ts.min() < self.floor:
+            live = ts >= self.floor
+            pos, ts, prios = pos[live], ts[live], prios[live]
+        missing = ~self._held(ts)
+        if missing.any():
+            for t in set(ts[missing].tolist()):
+                self._row_for(t)
+        # When a cell appears more than once (an agent staying in place),
+        # the last write wins, just like when reserving one node at a time
+        idx = (ts % self.horizon) * self.size + pos
+        self._invalidate(self._flat_owners[idx], agent)
+        self._flat_owners[idx] = agent
+        self._flat_priorities[idx] = prios
+        self._held_by[agent].update((ts * self.size + pos).tolist())
+
+    def recheck_path(self, nodes: Iterable[ReservationNode], agent: int) -> bool:
+        """Check that the agent still holds all the nodes of a path it has reserved whole
+
+        Only the paths of invalidated agents are actually checked. Besides
+        nodes reserved by other agents, nodes reserved by nobody also break
+        the path: they were taken over and released again, and the agent
+        would walk through them unprotected.
+        """
+        if agent not in self._invalidated:
+            return True
+        # The agent either keeps a path it holds whole or replans
+        self._invalidated.remove(agent)
+        pos, ts = _split(nodes)
+        rows = ts % self.horizon
+        owners = self._flat_owners[rows * self.size + pos]
+        held = self._row_times[rows] == ts
+        return bool((held & (owners == agent)).all())
+
+    def _invalidate(self, owners: np.ndarray, agent: int):
+        """Mark the previous owners of cells being reserved by `agent` as invalidated"""
+        taken = owners[(owners != NO_AGENT) & (owners != agent)]
+        if taken.size:
+            self._invalidated.update(taken.tolist())
+
+    def holders(self, cells: Sequence[int], t: int) -> Set[int]:
+        """Return the agents holding any of the given cells at `t` or later, standing reservations included"""
+        rows = np.flatnonzero(self._row_times >= max(t, self.floor))
+        owners = self.owners[np.ix_(rows, np.asarray(cells, dtype=np.int64))]
+        return set(owners[owners != NO_AGENT].tolist())
+
+    def release_all(self, agent: int):
+        """Cancel all reservations held by the agent"""
+        self.release_after(agent, self.floor - 1)
+
+    def release_after(self, agent: int, t: int):
+        """Cancel all reservations the agent holds for timesteps after `t`"""
+        held = self._held_by[agent]
+        keys = np.fromiter(held, dtype=np.int64, count=len(held))
+        ts, pos = np.divmod(keys, self.size)
+        released = ts > t
+        # Keys for past timesteps are kept only until they expire
+        self._held_by[agent] = set(keys[~released & (ts >= self.floor)].tolist())
+        pos, ts = pos[released], ts[released]
+        rows = ts % self.horizon
+        idx = rows * self.size + pos
+        mine = (self._flat_owners[idx] == agent) & (self._row_times[rows] == ts)
+        self._flat_owners[idx[mine]] = NO_AGENT
+
+    def contested(self, nodes: Iterable[ReservationNode], agent: int, priorities: Sequence[int]) -> List[ReservationNode]:
+        """Return the nodes and twins reserve_path() would take from other agents with the same or higher priority"""
+        pos, ts = _with_twins(nodes)
+        prios = np.repeat(np.asarray(priorities, dtype=np.int8), 2)
+        # Only the first write to a cell can take it from someone else
+        _, first = np.unique(np.stack((pos, ts)), axis=1, return_index=True)
+        first.sort()
+        pos, ts, prios = pos[first], ts[first], prios[first]
+        held = self._held(ts)
+        pos, ts, prios = pos[held], ts[held], prios[held]
+        idx = (ts % self.horizon) * self.size + pos
+        owners = self._flat_owners[idx]
+        taken = (owners != NO_AGENT) & (owners != agent) & (self._flat_priorities[idx] >= prios)
+        return [ReservationNode(p, t) for p, t in zip(pos[taken].tolist(), ts[taken].tolist())]
+
+    def reserve_standing(self, agent: int, pos: int, t: int, priority: int):
+        """Reserve `pos` for the agent at `t` and all timesteps after it, until cancel_standing()"""
+        if agent >= len(self._standing_pos):
+            grown = max(agent + 1, 2 * len(self._standing_pos))
+            self._standing_pos = np.concatenate((self._standing_pos, np.full(grown - len(self._standing_pos), -1, dtype=np.int64)))
+            self._standing_since.resize(grown, refcheck=False)
+            self._standing_priority.resize(grown, refcheck=False)
+        if self._standing_pos[agent] < 0:
+            self._standing_count += 1
+        self._standing_pos[agent] = pos
+        self._standing_since[agent] = t
+        self._standing_priority[agent] = priority
+        rows = np.flatnonzero(self._row_times >= max(t, self.floor))
+        self._invalidate(self.owners[rows, pos], agent)
+        self.owners[rows, pos] = agent
+        self.priorities[rows, pos] = priority
+
+    def cancel_standing(self, agent: int):
+        """Cancel the agent's standing reservation, in all timesteps it covers"""
+        pos = self._standing_pos[agent]
+        self._standing_pos[agent] = -1
+        self._standing_count -= 1
+        rows = np.flatnonzero(self._row_times >= max(self._standing_since[agent], self.floor))
+        rows = rows[self.owners[rows, pos] == agent]
+        self.owners[rows, pos] = NO_AGENT
+
+    def _fill_standing(self, row: int, t: int):
+        agents = np.flatnonzero((self._standing_pos >= 0) & (self._standing_since <= t))
+        idx = row * self.size + self._standing_pos[agents]
+        self._flat_owners[idx] = agents
+        self._flat_priorities[idx] = self._standing_priority[agents]
+
+    def _held(self, ts: np.ndarray) -> np.ndarray:
+        """Return a mask of the timesteps which are currently held by the ring"""
+        return self._row_times[ts % self.horizon] == ts
+
+
+def _split(nodes: Iterable[ReservationNode]) -> Tuple[np.ndarray, np.ndarray]:
+    """Convert the nodes into arrays of their positions and times"""
+    flat = np.fromiter(chain.from_iterable(nodes), dtype=np.int64)
+    return flat[0::2], flat[1::2]
+
+
+def _with_twins(nodes: Iterable[ReservationNode]) -> Tuple[np.ndarray, np.ndarray]:
+    """Like _split, but each node is followed by its t+1 twin"""
+    pos, ts = _split(nodes)
+    ts = ts.repeat(2)
+    ts[1::2] += 1
+    return pos.repeat(2), ts
+
+
+class SharedReservationGraph(ReservationGraph):
+    """A reservation graph kept in memory shared with forked processes
+
+    The planes and row times live in an anonymous shared mapping, so that
+    processes forked after the graph was created see each other's
+    reservations, and so do the flags of invalidated agents. The per-agent
+    indices of held cells stay private to each process.
+
+    The ring can't grow and rows can only be taken for new timesteps by
+    claim(), so that processes never race for them. Processes must only
+    touch cells no other process is touching at the same time.
+    """
+
+    def __init__(self, grid: GridGraph, agents: int, horizon=16):
+        super().__init__(grid, horizon)
+        self._invalidated = _SharedFlags(agents)
+
+    def _planes(self, horizon: int):
+        owners_size = horizon * self.size * 4
+        self._memory = mmap.mmap(-1, owners_size + horizon * self.size + horizon * 8)
+        owners = np.frombuffer(self._memory, dtype=np.int32, count=horizon * self.size).reshape(horizon, self.size)
+        priorities = np.frombuffer(self._memory, dtype=np.int8, count=horizon * self.size, offset=owners_size)
+        times = memoryview(self._memory)[owners_size + horizon * self.size:].cast("q")
+        owners.fill(NO_AGENT)
+        for row in range(horizon):
+            times[row] = -1
+        return owners, priorities.reshape(horizon, self.size), times
+
+    def _row_for(self, t: int) -> int:
+        row = t % self.horizon
+        if self._times[row] != t:
+            raise RuntimeError(f"Timestep {t} has not been claimed")
+        return row
+
+    def claim(self, start: int, end: int):
+        """Take rows for timesteps from `start` up to `end`, which must fit into the ring"""
+        if end - max(start, self.floor) > self.horizon:
+            raise ValueError("The timesteps don't fit into the shared ring")
+        for t in range(max(start, self.floor), end):
+            row = t % self.horizon
+            held = self._times[row]
+            if held == t:
+                continue
+            if held >= self.floor:
+                raise ValueError(f"Timestep {held} is still held")
+            self._times[row] = t
+            if self._standing_count:
+                self._fill_standing(row, t)
+
+
+class _SharedFlags:
+    """A set of agent IDs kept in shared memory, for SharedReservationGraph"""
+
+    def __init__(self, agents: int):
+        self._memory = mmap.mmap(-1, max(1, agents))
+
+    def __contains__(self, agent: int) -> bool:
+        return self._memory[agent] != 0
+
+    def add(self, agent: int):
+        self._memory[agent] = 1
+
+    def remove(self, agent: int):
+        self._memory[agent] = 0
+
+    def update(self, agents: Iterable[int]):
+        for agent in agents:
+            self._memory[agent] = 1
@@ -1,11 +1,11 @@
 import arcade
-from typing import List, Optional
+from typing import List, Optional, Sequence
 
 from evacsim.level import Level
 from .grid import Grid
 
 
-def start(lvl: Level, map_path: str, paths: Optional[List[List[int]]], cell_size=10, border=0):
+def start(lvl: Level, map_path: str, paths: Optional[Sequence[Sequence[int]]], cell_size=10, border=0):
     """Set up grid interface and start arcade's event loop."""
     lines: List[str] = []
     with open(map_path) as map_f:
@@ -1,31 +1,37 @@
 #! /usr/bin/env python3
 from __future__ import annotations
 from collections import deque
-from sys import stderr
 import typing
 
-from evacsim.graph.reservation_graph import ReservationGraph, ReservationNode, Reservation
+from evacsim.graph.reservation_graph import ReservationGraph, ReservationNode
 from evacsim.level import Level
+from .arena import SearchArena
+from .rra import RRACache
 from .strategy import Strategy
 from .surf import Surfing
+from .trace import DEBUG, WARN, Tracer
+from .trajectory import Trajectory
 
 
 class Agent:
-    def __init__(self, agent_id: int, level: Level, reservations: ReservationGraph, evacuation_class, debug=True):
+    def __init__(self, agent_id: int, level: Level, reservations: ReservationGraph, rra_cache: RRACache,
+                 search_arena: SearchArena, evacuation_class, tracer: typing.Optional[Tracer] = None):
         self.id = agent_id
         self.lookahead = 10
         self.level = level
         self.next_path: typing.Deque[ReservationNode] = deque()
-        self.taken_path = [ReservationNode(level.scenario.agents[agent_id].origin, 0)]
+        self.taken_path = Trajectory(level.scenario.agents[agent_id].origin)
         self.reservations = reservations
+        self.rra_cache = rra_cache
+        self.search_arena = search_arena
         self.evac_class = evacuation_class
-        self.debug = debug
+        self.tracer = tracer
         # Initialized in step()
         self.strategy: typing.Optional[Strategy] = None
 
     @property
     def pos(self) -> ReservationNode:
-        return self.taken_path[-1]
+        return self.taken_path.last
 
     def step(self):
         # Initialized here to respect the random
@@ -35,8 +41,10 @@ class Agent:
         elif self.strategy is None and not self.is_safe():
             self.strategy = self.evac_class(self)
         elif not isinstance(self.strategy, Surfing) and self.is_safe():
+            self.strategy.finish()
             self.strategy = Surfing(self)
         elif isinstance(self.strategy, Surfing) and not self.is_safe():
+            self.strategy.finish()
             self.strategy = self.evac_class(self)
 
         self.taken_path.append(self.strategy.step())
@@ -44,36 +52,78 @@ class Agent:
     def is_safe(self) -> bool:
         return self.level.is_safe(self.pos.pos())
 
+    def fall_asleep(self):
+        """Stop planning and keep staying in place until woken up"""
+        self.strategy.finish()
+        self.strategy = None
+        self.next_path.clear()
+        self.reservations.release_after(self.id, self.pos.t)
+        self.reservations.reserve_standing(self.id, self.pos.position, self.pos.t + 1, 2)
+
+    def wake_up(self, t: int):
+        """Catch up with timestep `t` after sleeping and start surfing again"""
+        self.catch_up(t)
+        self.strategy = Surfing(self)
+
+    def catch_up(self, t: int):
+        """Cancel the standing reservation of a sleeping agent and stay in place until timestep `t`"""
+        self.reservations.cancel_standing(self.id)
+        while self.pos.t < t:
+            self.taken_path.append(self.pos.incremented_t())
+
+    def reset(self):
+        """Drop the strategy, so that the agent picks one and plans anew in the next step"""
+        if self.strategy is not None:
+            self.strategy.finish()
+            self.strategy = None
+
+    def relocate(self, pos: int):
+        """Move into another position in the current timestep, dropping the planned path and its reservations"""
+        self.leave()
+        self.taken_path.relocate(pos)
+
+    def leave(self):
+        """Stop planning and release all reservations, including the current position"""
+        self.reset()
+        self.next_path.clear()
+        self.reservations.release_after(self.id, self.pos.t - 1)
+
+    def forget_taken_path(self):
+        """Drop the nodes of the taken path which no strategy looks back at anymore"""
+        if len(self.taken_path) > 2 * self.lookahead:
+            self.taken_path.forget(self.lookahead)
+
     def reserve_next_path(self, priorities=[]):
-        for i, node in enumerate(self.next_path):
-            priority = priorities[i] if len(priorities) > i else 2
-            this_r = self.reservations.get(node)
-            if this_r is not None and this_r.agent != self.id and this_r.priority >= priority:
-                self.log(f"WARN: Overwriting reservation ({node})")
-            next_r = self.reservations.get(node.incremented_t())
-            if next_r is not None and next_r.agent != self.id and next_r.priority >= priority:
-                self.log(f"WARN: Overwriting reservation ({node.incremented_t()} - inc)")
-            self.reservations.reserve(Reservation(node, self.id, priority))
-            self.reservations.reserve(Reservation(node.incremented_t(), self.id, priority))
+        priorities = priorities[:len(self.next_path)]
+        priorities += [2] * (len(self.next_path) - len(priorities))
+        if self.tracing(WARN):
+            for node in self.reservations.contested(self.next_path, self.id, priorities):
+                self.log("overwrite", WARN, node=node)
+        self.reservations.reserve_path(self.next_path, self.id, priorities)
 
     def cancel_reservations(self):
-        for node in self.next_path:
-            r = self.reservations.get(node)
-            if r is not None and r.agent == self.id:
-                self.reservations.cancel_reservation(node)
-            next_node = node.incremented_t()
-            r = self.reservations.get(next_node)
-            if r is not None and r.agent == self.id:
-                self.reservations.cancel_reservation(next_node)
+        # Releases everything the agent holds in the future, not just what's
+        # on next_path, so that no stale reservations are left behind.
+        # The current node's t+1 twin is released only when next_path covers
+        # it, either as the twin of the current node or as the first step.
+        guard = self.reservations.get(self.pos.incremented_t())
+        self.reservations.release_after(self.id, self.pos.t)
+        if guard is not None and guard.agent == self.id and \
+                self.pos not in self.next_path and guard.node not in self.next_path:
+            self.reservations.reserve(guard)
 
     def check_reservations(self) -> bool:
-        for node in self.next_path:
-            res = self.reservations.get(node)
-            if res is not None and res.agent != self.id:
-                return False
-        return True
-
-    def log(self, msg):
-        if self.debug:
-            s = self.strategy.name() if self.strategy is not None else ""
-            print(f"a={self.id}{s} t={self.taken_path[-1].t}: {msg}", file=stderr)
+        # The agent always reserves its whole path, so it can only have been
+        # broken by someone overwriting the reservations
+        return self.reservations.recheck_path(self.next_path, self.id)
+
+    def tracing(self, level=DEBUG) -> bool:
+        """Check whether the agent's events of the given level are traced"""
+        return self.tracer is not None and level >= self.tracer.level
+
+    def log(self, event: str, level=DEBUG, **payload):
+        """Trace an event of the agent in the current timestep, see Tracer"""
+        if self.tracer is not None and level >= self.tracer.level:
+            if self.strategy is not None:
+                payload["strategy"] = self.strategy.name()
+            self.tracer.emit(level, self.id, self.pos.t, event, payload)
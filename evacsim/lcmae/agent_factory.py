@@ -1,15 +1,23 @@
+from typing import Optional
+
 import evacsim.lcmae.evacuation as evac
 from evacsim.level import Agent as LevelAgent, AgentType, Level
 from evacsim.graph.reservation_graph import ReservationGraph
 from evacsim.graph.nx_graph import NxNode
 from .agent import Agent
+from .arena import SearchArena
+from .rra import RRACache
+from .trace import Tracer
 
 
 class AgentFactory():
-    def __init__(self, level: Level, reservations: ReservationGraph, debug=True):
+    def __init__(self, level: Level, reservations: ReservationGraph, rra_cache: RRACache, tracer: Optional[Tracer] = None):
         self.level = level
         self.reservations = reservations
-        self.debug = debug
+        self.rra_cache = rra_cache
+        # All agents search one at a time, so they can share the buffers
+        self.search_arena = SearchArena(level.cols)
+        self.tracer = tracer
         self.curr_id = -1
 
     def retargeting_agent(self) -> Agent:
@@ -26,7 +34,7 @@ class AgentFactory():
 
     def _agent_with_evac_class(self, cls) -> Agent:
         self.curr_id += 1
-        return Agent(self.curr_id, self.level, self.reservations, cls, debug=self.debug)
+        return Agent(self.curr_id, self.level, self.reservations, self.rra_cache, self.search_arena, cls, tracer=self.tracer)
 
     def from_scenario(self, scn_agent: LevelAgent) -> Agent:
         t = scn_agent.type
@@ -0,0 +1,67 @@
+from array import array
+from typing import List, Tuple
+
+
+class SearchArena:
+    """Preallocated buffers for windowed spacetime searches
+
+    A search starting at a cell and looking `depth` timesteps ahead can only
+    reach cells at most `depth` steps away from it. Every node of such a
+    window gets a slot, ordered by its timestep offset (the layer) and then
+    its row and column relative to the start.
+
+    A slot's values are only valid when its stamp matches the arena's
+    current generation, so that starting a new search just increments the
+    generation instead of clearing the buffers. One arena is shared by all
+    agents of a planning run, since they never search at the same time.
+    The buffers grow when a search looks further ahead than any before.
+    """
+
+    def __init__(self, cols: int, depth=0):
+        self.cols = cols
+        self.generation = 0
+        self.opened: List[Tuple] = []
+        self._allocate(depth)
+
+    def _allocate(self, depth: int):
+        self.depth = depth
+        self.width = 2 * depth + 1
+        size = (depth + 1) * self.width * self.width
+        # Slots with a known g-cost and closed slots are stamped with the generation
+        self.seen = array("l", [0]) * size
+        self.closed = array("l", [0]) * size
+        self.g_costs = array("l", [0]) * size
+        self.predecessors = array("l", [0]) * size
+        # Windows are layered, so the slot of a successor differs from its
+        # predecessor's by a constant depending only on the move's direction
+        layer = self.width * self.width
+        self.successor_offsets = {
+            1: layer + 1,
+            -1: layer - 1,
+            self.cols: layer + self.width,
+            -self.cols: layer - self.width,
+            0: layer,
+        }
+
+    def reset(self, start: int, depth: int) -> int:
+        """Prepare the arena for a new search and return its generation"""
+        if depth > self.depth:
+            self._allocate(depth)
+            self.generation = 0
+        self.generation += 1
+        self.opened.clear()
+        start_row, start_col = divmod(start, self.cols)
+        # The top left corner of the window
+        self.top = start_row - self.depth
+        self.left = start_col - self.depth
+        return self.generation
+
+    def slot(self, pos: int, layer: int) -> int:
+        row, col = divmod(pos, self.cols)
+        return (layer * self.width + row - self.top) * self.width + col - self.left
+
+    def node(self, slot: int) -> Tuple[int, int]:
+        """Return the position and layer of the node in the slot"""
+        layer, rest = divmod(slot, self.width * self.width)
+        row, col = divmod(rest, self.width)
+        return (self.top + row) * self.cols + self.left + col, layer
@@ -3,7 +3,6 @@ from abc import ABC, abstractmethod
 from collections import deque
 from evacsim.graph.nx_graph import NxNode
 from evacsim.graph.reservation_graph import ReservationNode
-from evacsim.lcmae.rra import RRAHeuristic
 from evacsim.lcmae.strategy import Strategy
 from evacsim.lcmae.w_astar import WindowedAstar
 
@@ -14,14 +13,13 @@ class Evacuating(Strategy, ABC):
         self.goal = None
         self.distance_with_goal = 0
         self.distance_to_goal = 0
+        self.rra = None
         self.retarget()
         self.replan()
 
-    def _rra(self, x, y):
+    def _rra(self, pos: int) -> int:
         # RRA is *reversed* so our goal is its start
-        if y != self.rra.start:
-            raise RuntimeError("Trying to get RRA* heuristic distance to a node different from the goal")
-        return self.rra.distance(NxNode(x.pos()))
+        return self.rra.distance(pos)
 
     @abstractmethod
     def find_goal(self) -> typing.Tuple[NxNode, int]:
@@ -29,10 +27,20 @@ class Evacuating(Strategy, ABC):
 
     def retarget(self):
         self.goal, self.distance_to_goal = self.find_goal()
-        self.rra = RRAHeuristic(self.agent.level, NxNode(self.agent.pos.pos()), NxNode(self.goal.pos()))
+        # Acquired before releasing the old one, so that it isn't
+        # evicted when the agent keeps its goal
+        rra = self.agent.rra_cache.acquire(self.goal.pos())
+        self.finish()
+        self.rra = rra
+
+    def finish(self):
+        if self.rra is not None:
+            self.agent.rra_cache.release(self.rra.start)
+            self.rra = None
 
     def pathfind(self) -> typing.List[ReservationNode]:
-        search = WindowedAstar(self.agent.reservations, self.agent, self._rra, self.agent.pos, self.goal, self.agent.lookahead)
+        search = WindowedAstar(self.agent.reservations, self.agent, self._rra, self.agent.pos, self.goal,
+                               self.agent.lookahead, self.agent.search_arena)
         if not search.pathfind():
             # closest_frontier finder should either have found a path to safety
             # and we should be able to find it in spacetime, even if it becomes
@@ -43,7 +51,7 @@ class Evacuating(Strategy, ABC):
     def replan(self):
         self.agent.cancel_reservations()
         self.agent.next_path = deque(self.pathfind()[1:])
-        self.agent.log(f"Next: {self.agent.next_path}")
+        self.agent.log("plan", path=self.agent.next_path)
         self.agent.reserve_next_path()
 
     def step(self) -> ReservationNode:
@@ -1,20 +1,25 @@
 from typing import Tuple
 
-from evacsim.astar import AStar
-from evacsim.manhattan import ManhattanDistanceHeuristic
-from evacsim.graph.nx_graph import NxGraph, NxNode
+from evacsim.graph.nx_graph import NxNode
 from evacsim.lcmae.agent import Agent
 from .abstract import Evacuating
 
 
 class FixedTargetEvacuation(Evacuating):
     def __init__(self, agent: Agent, target: NxNode):
-        self.heuristic = ManhattanDistanceHeuristic(agent.level)
         self.target_node = target
         super().__init__(agent)
 
+    def retarget(self):
+        # The search is acquired before find_goal() reads the distance from
+        # it, so that it can't be evicted and built anew in between
+        rra = self.agent.rra_cache.acquire(self.target_node.pos())
+        self.finish()
+        self.rra = rra
+        self.goal, self.distance_to_goal = self.find_goal()
+
     def find_goal(self) -> Tuple[NxNode, int]:
-        nxg = NxGraph(self.agent.level.g)
-        search = AStar(nxg, self.heuristic.manhattan_distance, NxNode(self.agent.pos.pos()), self.target_node)
-        search.pathfind()
-        return self.target_node, len(search.reconstruct_path())
+        # The RRA* search towards the target, shared by all agents heading
+        # there, already knows the distance. It's measured in nodes of the
+        # path, including both ends.
+        return self.target_node, self.rra.distance(self.agent.pos.pos()) + 1
@@ -24,12 +24,12 @@ class PanicEvacuation(Evacuating):
 
     def neighbors(self, n: ReservationNode) -> typing.List[typing.Tuple[ReservationNode, int]]:
         neighbors = []
-        for k in self.agent.reservations.g[n.pos()].keys():
-            rn = ReservationNode(k, n.t + 1)
-            if self._reservable_by(rn) and self._reservable_by(rn.incremented_t()):
-                neighbors.append((rn, 1))
-        this_node = n.incremented_t()
-        this_reservable = (self._reservable_by(this_node) and self._reservable_by(this_node.incremented_t()))
+        t = n.t + 1
+        for k in self.agent.level.grid.adjacent(n.position):
+            if self._reservable_by(k, t) and self._reservable_by(k, t + 1):
+                neighbors.append((ReservationNode(k, t), 1))
+        this_node = ReservationNode(n.position, t)
+        this_reservable = (self._reservable_by(n.position, t) and self._reservable_by(n.position, t + 1))
         if this_reservable:
             neighbors.append((this_node, 1))
         elif self.agent.pos.pos() == this_node.pos():
@@ -38,6 +38,5 @@ class PanicEvacuation(Evacuating):
             neighbors.append((this_node, 2))
         return neighbors
 
-    def _reservable_by(self, node: ReservationNode) -> bool:
-        reservation = self.agent.reservations.get(node)
-        return reservation is None or reservation.agent == self.agent.id or reservation.priority < 2
+    def _reservable_by(self, pos: int, t: int) -> bool:
+        return self.agent.reservations.reservable_by(pos, t, self.agent.id, 2)
@@ -1,5 +1,6 @@
 from evacsim.lcmae.agent import Agent
 from evacsim.graph.reservation_graph import ReservationNode
+from evacsim.lcmae.trace import INFO
 from .closest_frontier import ClosestFrontierEvacuation
 
 
@@ -14,10 +15,10 @@ class RetargetingEvacuation(ClosestFrontierEvacuation):
 
     def step(self) -> ReservationNode:
         if self.distance_with_goal >= 2 * self.distance_to_goal:
-            self.agent.log("Waiting too long for goal, retargeting")
+            self.agent.log("retarget", INFO, goal=self.goal.pos())
             old_goal = self.goal
             self.retarget()
             if self.goal != old_goal:
-                self.agent.log("Found new target")
+                self.agent.log("new_goal", INFO, goal=self.goal.pos())
             self.replan()
         return super().step()
@@ -0,0 +1,162 @@
+"""
+This module plans a single LC-MAE evacuation in several worker processes
+"""
+from array import array
+import multiprocessing
+import random
+from sys import stderr
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from evacsim.graph.reservation_graph import SharedReservationGraph, Reservation, ReservationNode
+from evacsim.level import Level
+from .agent import Agent
+from .agent_factory import AgentFactory
+from .rra import RRACache
+from .trace import Tracer
+
+# Long enough for the windows of all agents, with their t+1 twins
+HORIZON = 64
+
+
+def plan_evacuation_parallel(level: Level, workers: int, random_seed=42, debug=True) -> List[Sequence[int]]:
+    """Plan the evacuation on the given level using LC-MAE in `workers` processes
+
+    The map is split into horizontal strips taller than three times the
+    agents' lookahead, so that agents in strips which aren't adjacent can
+    never touch the same reservations, even when cancelling the rest of a
+    path planned several steps ago. Every timestep is stepped in two
+    phases, the even strips first and the odd ones second, with the strips
+    of a phase dealt out among the workers. All reservations are kept in a
+    SharedReservationGraph, so the workers see each other's right away.
+
+    Every worker holds a copy of all agents but steps only those in its
+    strips. When an agent moves into another worker's strip, its old worker
+    cancels its reservations and the new one catches its copy up with the
+    path taken in the meantime and lets it plan anew.
+
+    Workers are forked, so this only works where the fork start method is
+    available.
+    """
+    if level.scenario.spread:
+        raise ValueError("The parallel planner doesn't support spreading danger")
+    random.seed(random_seed)
+    reservations = SharedReservationGraph(level.grid, len(level.scenario.agents), HORIZON)
+    factory = AgentFactory(level, reservations, RRACache(level), Tracer(stderr) if debug else None)
+    agents = [factory.from_scenario(agent) for agent in level.scenario.agents]
+    if not agents:
+        return []
+    lookahead = agents[0].lookahead
+    window = 2 * lookahead + 2
+    reservations.claim(0, window)
+    for agent in agents:
+        for i in range(agent.lookahead):
+            n = agent.pos.incremented_t(i)
+            reservations.reserve(Reservation(n, agent.id, 2))
+            agent.next_path.append(n)
+    paths = [array("i", [agent.pos.position]) for agent in agents]
+    pool = _Workers(agents, reservations, workers, random_seed)
+    try:
+        owners: List[Optional[int]] = [None] * len(agents)
+        strip_height = 3 * lookahead + 4
+        t = 0
+        deadlock_timer = 0
+        while deadlock_timer < 15 and not all(level.is_safe(path[-1]) for path in paths):
+            deadlock_timer += 1
+            reservations.expire(t)
+            reservations.claim(t, t + window)
+            phases: List[List[List[int]]] = [[[] for _ in range(workers)] for _ in range(2)]
+            leaving: List[List[int]] = [[] for _ in range(workers)]
+            arriving: List[List[Dict[int, Sequence[int]]]] = [[{} for _ in range(workers)] for _ in range(2)]
+            for agent_id, path in enumerate(paths):
+                strip = path[-1] // level.cols // strip_height
+                worker = (strip // 2) % workers
+                phases[strip % 2][worker].append(agent_id)
+                if owners[agent_id] != worker:
+                    if owners[agent_id] is not None:
+                        leaving[owners[agent_id]].append(agent_id)
+                    arriving[strip % 2][worker][agent_id] = path
+                    owners[agent_id] = worker
+            pool.run("release", t, leaving, [{}] * workers)
+            for phase, phase_arriving in zip(phases, arriving):
+                for moves in pool.run("step", t, phase, phase_arriving):
+                    for agent_id, pos in moves:
+                        paths[agent_id].append(pos)
+                        if pos != paths[agent_id][-2]:
+                            deadlock_timer = 0
+            t += 1
+    finally:
+        pool.close()
+    return paths
+
+
+class _Workers:
+    """Worker processes holding copies of all the agents, controlled through pipes"""
+
+    def __init__(self, agents: List[Agent], reservations: SharedReservationGraph, count: int, random_seed: int):
+        context = multiprocessing.get_context("fork")
+        self.connections = []
+        self.processes = []
+        for i in range(count):
+            ours, theirs = context.Pipe()
+            process = context.Process(target=_work, args=(theirs, agents, reservations, random_seed + i), daemon=True)
+            process.start()
+            theirs.close()
+            self.connections.append(ours)
+            self.processes.append(process)
+
+    def run(self, command: str, t: int, agent_ids: List[List[int]], arriving: List[Dict[int, Sequence[int]]]) -> List:
+        """Send the command to the workers with any agents to handle and return their replies"""
+        busy = [i for i, ids in enumerate(agent_ids) if ids]
+        for i in busy:
+            self.connections[i].send((command, t, agent_ids[i], arriving[i]))
+        return [self.connections[i].recv() for i in busy]
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(None)
+        for process in self.processes:
+            process.join()
+
+
+def _work(connection, agents: List[Agent], reservations: SharedReservationGraph, random_seed: int):
+    random.seed(random_seed)
+    while True:
+        message = connection.recv()
+        if message is None:
+            return
+        command, t, agent_ids, arriving = message
+        # Only updates this process' idea of the floor, the rows have
+        # already been dropped by the main process
+        reservations.expire(t)
+        if command == "release":
+            for agent_id in agent_ids:
+                agents[agent_id].cancel_reservations()
+                _forget_plan(agents[agent_id])
+            connection.send(None)
+            continue
+        for agent_id, path in arriving.items():
+            _catch_up(agents[agent_id], path)
+        stepped = [agents[agent_id] for agent_id in agent_ids]
+        random.shuffle(stepped)
+        # Endangered agents go first, as in plan_evacuation()
+        stepped.sort(key=Agent.is_safe)
+        moves: List[Tuple[int, int]] = []
+        for agent in stepped:
+            agent.step()
+            agent.forget_taken_path()
+            moves.append((agent.id, agent.pos.position))
+        connection.send(moves)
+
+
+def _forget_plan(agent: Agent):
+    if agent.strategy is not None:
+        agent.strategy.finish()
+        agent.strategy = None
+    agent.next_path.clear()
+
+
+def _catch_up(agent: Agent, path: Sequence[int]):
+    """Bring the agent's copy up to date with the path it has taken"""
+    _forget_plan(agent)
+    for t in range(agent.pos.t + 1, len(path)):
+        agent.taken_path.append(ReservationNode(path[t], t))
@@ -0,0 +1,379 @@
+"""
+This module advances an LC-MAE evacuation plan one timestep at a time
+"""
+from array import array
+from collections import deque
+from dataclasses import dataclass, field
+import random
+from sys import stderr
+from time import monotonic, perf_counter
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from evacsim.graph.reservation_graph import ReservationGraph, Reservation
+from evacsim.level import Agent as LevelAgent, Level
+from .agent_factory import AgentFactory
+from .agent import Agent
+from .evacuation import ClosestFrontierEvacuation
+from .evacuation.abstract import Evacuating
+from .rra import RRACache
+from .scheduler import SleepScheduler
+from .trace import Tracer
+from .trajectory import Trajectory
+
+
+def step_and_divide(agents: List[Agent]) -> Tuple[List[Agent], List[Agent]]:
+    """Call step() on all the given agents and divide them into endangered and safe ones"""
+    random.shuffle(agents)
+    endangered = []
+    safe = []
+    for agent in agents:
+        agent.step()
+        if agent.is_safe():
+            safe.append(agent)
+        else:
+            endangered.append(agent)
+    return endangered, safe
+
+
+def agent_broke_deadlock(a: Agent) -> bool:
+    """Check whether the given agent moved into another vertex"""
+    return len(a.taken_path) < 2 or a.taken_path[-1].pos() != a.taken_path[-2].pos()
+
+
+@dataclass
+class PlanDelta:
+    """A change of the evacuation, applied by Planner.update()"""
+    # Cells which have become dangerous
+    danger: Sequence[int] = ()
+    # New positions of agents, by agent ID
+    moved: Dict[int, int] = field(default_factory=dict)
+    # Agents which have appeared, getting the next free IDs in order
+    added: Sequence[LevelAgent] = ()
+    # IDs of agents which are no longer part of the evacuation
+    removed: Sequence[int] = ()
+
+
+@dataclass
+class PlannerSnapshot:
+    """The state of a plan being made online, as returned by Planner.snapshot()"""
+    t: int
+    positions: List[int]
+    # Distances of the agents which are still endangered, see Planner.remaining_distances()
+    endangered: Dict[int, Optional[int]]
+    finished: bool
+    # The 99th percentile of the latencies of recent tick() calls in seconds, None before the first one
+    tick_p99: Optional[float]
+
+
+def _heads_to(agent: Agent, goals: Set[int]) -> bool:
+    """Check whether the agent is evacuating to one of the given goals"""
+    strategy = agent.strategy
+    return isinstance(strategy, Evacuating) and strategy.goal is not None and strategy.goal.pos() in goals
+
+
+class Planner:
+    """The state of an LC-MAE evacuation plan being made, advanced by step()
+
+    Safe agents farther than `sleep_radius` from all endangered and
+    recently rescued ones are put to sleep (see SleepScheduler). Passing
+    None keeps all agents awake. Agents only remember the recent part of
+    the paths they have taken, so whoever needs the plan has to collect the
+    positions.
+
+    The agents' decisions are traced by `tracer`. Without one, `debug`
+    traces them into the standard error output.
+
+    The planner works on its own copy of the level, so that spreading
+    danger and the changes applied by update() don't affect the level
+    passed in.
+
+    To follow an evacuation as it goes on, feed the agents' observed
+    positions to observe() and advance the plan with tick(), which keeps
+    the latencies of the last `latency_window` calls.
+
+    A plan made earlier, even by another process, can be continued by
+    passing its first timesteps as the `prefix`. It holds the paths of the
+    scenario's first agents, and planning continues from its last
+    timestep: the agents stand where it leaves them, those at -1 are
+    removed, and the danger scheduled to spread before it has spread. The
+    scenario's other agents appear at their origins. Everything the agents
+    had planned beyond the prefix is gone, so all of them plan anew.
+    """
+
+    def __init__(self, level: Level, random_seed=42, debug=True, sleep_radius: Optional[int] = 40,
+                 tracer: Optional[Tracer] = None, latency_window=1000,
+                 prefix: Optional[Sequence[Sequence[int]]] = None):
+        random.seed(random_seed)
+        if tracer is None and debug:
+            tracer = Tracer(stderr)
+        level = level.copy()
+        t = 0
+        if prefix:
+            t = len(prefix[0]) - 1
+            if len(prefix) > len(level.scenario.agents) or any(len(path) != t + 1 for path in prefix):
+                raise ValueError("The prefix has to hold equally long paths of the scenario's agents")
+            level.add_danger([cell for when, cells in level.scenario.spread.items() if when < t for cell in cells])
+            level.scenario.agents[:len(prefix)] = [agent._replace(origin=path[-1]) if path[-1] >= 0 else agent
+                                                   for agent, path in zip(level.scenario.agents, prefix)]
+        self.level = level
+        self.reservations = ReservationGraph(level.grid)
+        # Agents heading to the same goal share their RRA* searches
+        self.rra_cache = RRACache(level)
+        self.factory = AgentFactory(level, self.reservations, self.rra_cache, tracer)
+        self.agents = [self.factory.from_scenario(agent) for agent in level.scenario.agents]
+        for agent in self.agents:
+            if t:
+                agent.taken_path = Trajectory(agent.pos.position, t)
+            self._place(agent)
+        # IDs of the agents removed by update()
+        self.removed: Set[int] = set()
+        self.safe = [agent for agent in self.agents if agent.is_safe()]
+        self.endangered = [agent for agent in self.agents if not agent.is_safe()]
+        self.scheduler = SleepScheduler(level, sleep_radius) if sleep_radius else None
+        # Time is watched independently by agents but this variable makes
+        # debugging easier
+        self.t = t
+        self.deadlock_timer = 0
+        self.latencies: Deque[float] = deque(maxlen=latency_window)
+        if prefix:
+            removed = [agent for agent, path in enumerate(prefix) if path[-1] < 0]
+            if removed:
+                self.update(PlanDelta(removed=removed))
+
+    @property
+    def finished(self) -> bool:
+        """Whether all agents are safe for good or the swarm has been stuck for too long"""
+        return self.deadlock_timer >= 15 or not (self.endangered or self.level.scenario.spreads_from(self.t))
+
+    def positions(self) -> List[int]:
+        """Return the positions of all the agents in the current timestep"""
+        # Sleeping agents lag behind but they stay in place, so their
+        # positions are known for the timesteps they haven't caught up with
+        return [agent.pos.position if agent.id not in self.removed else -1 for agent in self.agents]
+
+    def step(self) -> List[int]:
+        """Plan the next timestep and return the agents' positions in it
+
+        Danger scheduled to spread in the current timestep spreads first.
+        """
+        spread = self.level.scenario.spread.get(self.t)
+        if spread:
+            self.update(PlanDelta(danger=spread))
+        for agent in self.agents:
+            agent.forget_taken_path()
+        self.deadlock_timer += 1
+        # Agents never look into the past, so the reservations for timesteps
+        # the whole swarm has already left can be dropped. Sleeping agents
+        # lag behind but their standing reservations never expire.
+        self.reservations.expire(self.t)
+        still_endangered, newly_safe = step_and_divide(self.endangered)
+        newly_endangered, still_safe = step_and_divide(self.safe)
+        self.endangered = still_endangered + newly_endangered
+        self.safe = still_safe + newly_safe
+        scenario = self.level.scenario
+        if not scenario.spread:
+            moved = any(map(agent_broke_deadlock, self.safe)) or any(map(agent_broke_deadlock, self.endangered))
+        elif scenario.spreads_from(self.t + 1):
+            # A swarm waiting in safety for the danger to spread isn't stuck
+            moved = not self.endangered or any(map(agent_broke_deadlock, self.safe)) or \
+                any(map(agent_broke_deadlock, self.endangered))
+        else:
+            # Once it has spread, safe agents can keep shuffling around
+            # endangered ones who wait for them next to the new frontier in
+            # vain, so only the endangered agents' moves count
+            moved = bool(newly_safe) or any(map(agent_broke_deadlock, self.endangered))
+        if moved:
+            self.deadlock_timer = 0
+        self.t += 1
+        if self.scheduler:
+            self.safe = self.scheduler.schedule(self.safe, self.endangered, self.t)
+        return self.positions()
+
+    def observe(self, positions: Sequence[int]):
+        """Correct the agents' positions in the current timestep by the observed ones
+
+        Agents observed elsewhere than where the plan put them are moved
+        there and agents observed at -1 are removed, see update().
+        """
+        if len(positions) != len(self.agents):
+            raise ValueError(f"Expected positions of {len(self.agents)} agents, got {len(positions)}")
+        moved = {}
+        removed = []
+        for agent, (planned, observed) in enumerate(zip(self.positions(), positions)):
+            if observed == planned:
+                continue
+            if observed < 0:
+                removed.append(agent)
+            else:
+                moved[agent] = observed
+        if moved or removed:
+            self.update(PlanDelta(moved=moved, removed=removed))
+
+    def tick(self) -> Dict[int, int]:
+        """Plan the next timestep and return the new positions of the agents which move in it, by agent ID"""
+        start = perf_counter()
+        before = self.positions()
+        moves = {agent: pos for agent, (old, pos) in enumerate(zip(before, self.step())) if pos != old}
+        self.latencies.append(perf_counter() - start)
+        return moves
+
+    def tick_p99(self) -> Optional[float]:
+        """Return the 99th percentile of the latencies of recent tick() calls in seconds, None before the first one"""
+        if not self.latencies:
+            return None
+        return float(np.percentile(self.latencies, 99))
+
+    def snapshot(self) -> PlannerSnapshot:
+        """Return the state of the plan in the current timestep"""
+        return PlannerSnapshot(self.t, self.positions(), self.remaining_distances(), self.finished, self.tick_p99())
+
+    def update(self, delta: PlanDelta):
+        """Apply a change of the evacuation in the current timestep, keeping as much of the plan as possible
+
+        Only the agents the change affects plan anew in the next step: the
+        moved and added ones, those which held reservations of the new
+        danger, and those heading to a goal which has become dangerous.
+        Everyone else keeps their planned paths and reservations, and
+        sleeping agents stay asleep unless they were affected. Moved agents
+        simply appear in their new positions. Removed agents no longer
+        move or hold reservations and their positions are reported as -1,
+        until they are moved somewhere again.
+        """
+        awake: Dict[int, Agent] = {agent.id: agent for agent in self.safe + self.endangered}
+        for agent_id in delta.removed:
+            agent = self.agents[agent_id]
+            self._unschedule(agent)
+            agent.leave()
+            awake.pop(agent_id, None)
+            self.removed.add(agent_id)
+        new_danger, moved_frontier = self.level.add_danger(delta.danger)
+        if new_danger:
+            affected = self.reservations.holders(new_danger, self.t)
+            if not self.rra_cache.users.keys().isdisjoint(new_danger):
+                dangerous_goals = set(new_danger)
+                affected.update(agent.id for agent in awake.values() if _heads_to(agent, dangerous_goals))
+            if moved_frontier.size:
+                affected.update(self._retargeted(awake.values(), set(moved_frontier.tolist())))
+            for agent_id in affected - self.removed:
+                agent = self.agents[agent_id]
+                self._unschedule(agent)
+                agent.reset()
+                awake[agent_id] = agent
+        for agent_id, pos in delta.moved.items():
+            agent = self.agents[agent_id]
+            if agent_id in self.removed:
+                # Removed agents which are moved take part again, from now on
+                self.removed.remove(agent_id)
+                agent.taken_path = Trajectory(pos, self.t)
+            else:
+                self._unschedule(agent)
+                agent.relocate(pos)
+            self._place(agent)
+            awake[agent_id] = agent
+        for scn_agent in delta.added:
+            self.level.scenario.agents.append(scn_agent)
+            agent = self.factory.from_scenario(scn_agent)
+            agent.taken_path = Trajectory(scn_agent.origin, self.t)
+            self.agents.append(agent)
+            self._place(agent)
+            awake[agent.id] = agent
+        self.safe = [agent for agent in awake.values() if agent.is_safe()]
+        self.endangered = [agent for agent in awake.values() if not agent.is_safe()]
+        self.deadlock_timer = 0
+
+    def _retargeted(self, agents: Iterable[Agent], cells: Set[int]) -> Iterator[int]:
+        """Yield the IDs of the agents heading to the closest frontier node which now have a different one"""
+        for agent in agents:
+            if isinstance(agent.strategy, ClosestFrontierEvacuation) and agent.pos.position in cells:
+                closest = self.level.closest_frontier(agent.pos.position)
+                if closest is not None and closest[0] != agent.strategy.goal.pos():
+                    yield agent.id
+
+    def _place(self, agent: Agent):
+        """Reserve the agent's position for its lookahead, so that it plans from it in the next step"""
+        for i in range(agent.lookahead):
+            n = agent.pos.incremented_t(i)
+            self.reservations.reserve(Reservation(n, agent.id, 2))
+            agent.next_path.append(n)
+
+    def _unschedule(self, agent: Agent):
+        """Make a sleeping agent catch up with the current timestep, without planning"""
+        if self.scheduler and self.scheduler.remove(agent):
+            agent.catch_up(self.t)
+
+    def remaining_distances(self) -> Dict[int, Optional[int]]:
+        """Return the distances of the endangered agents from the closest safe nodes, by agent ID
+
+        Agents with no way to safety have None as their distance.
+        """
+        distances: Dict[int, Optional[int]] = {}
+        for agent in self.endangered:
+            closest = self.level.closest_frontier(agent.pos.position)
+            distances[agent.id] = closest[1] if closest is not None else None
+        return distances
+
+
+@dataclass
+class PartialPlan:
+    """A prefix of an evacuation plan, as returned by AnytimePlanner"""
+    paths: List[Sequence[int]]
+    # Distances of the agents which are still endangered, see Planner.remaining_distances()
+    endangered: Dict[int, Optional[int]]
+    finished: bool
+
+
+class AnytimePlanner:
+    """Plans an evacuation using LC-MAE in bounded chunks of time or timesteps
+
+    Every call to plan() continues where the previous one stopped. The
+    arguments are the same as Planner's. The plan starts with the `prefix`,
+    where the agents which aren't part of it hold -1.
+    """
+
+    def __init__(self, level: Level, random_seed=42, debug=True, sleep_radius: Optional[int] = 40,
+                 tracer: Optional[Tracer] = None, prefix: Optional[Sequence[Sequence[int]]] = None):
+        self.planner = Planner(level, random_seed, debug, sleep_radius, tracer, prefix=prefix)
+        prefix = prefix or []
+        self.paths = [array("i", path) for path in prefix]
+        for pos in self.planner.positions()[len(prefix):]:
+            self.paths.append(array("i", [-1]) * self.planner.t + array("i", [pos]))
+
+    def update(self, delta: PlanDelta):
+        """Apply a change of the evacuation in the timestep planned last, see Planner.update()
+
+        The change can only be applied at the end of the plan made so far,
+        so a plan followed as the evacuation goes on should only be made a
+        few timesteps ahead, using `max_ticks`. To apply it in an earlier
+        timestep, start another AnytimePlanner with the plan cut after that
+        timestep as its prefix. The paths of added agents hold -1 in the
+        timesteps before they appeared.
+        """
+        self.planner.update(delta)
+        positions = self.planner.positions()
+        for path, pos in zip(self.paths, positions):
+            path[-1] = pos
+        made = len(self.paths[0]) if self.paths else self.planner.t + 1
+        for pos in positions[len(self.paths):]:
+            self.paths.append(array("i", [-1]) * (made - 1) + array("i", [pos]))
+
+    def plan(self, deadline: Optional[float] = None, max_ticks: Optional[int] = None) -> PartialPlan:
+        """Keep planning until the plan is finished, `deadline` passes or `max_ticks` timesteps are planned
+
+        The deadline is compared with time.monotonic(). Planning stops
+        only between timesteps, so it can overrun the deadline by the time
+        one timestep takes.
+        """
+        ticks = 0
+        while not self.planner.finished:
+            if max_ticks is not None and ticks >= max_ticks:
+                break
+            if deadline is not None and monotonic() >= deadline:
+                break
+            for path, pos in zip(self.paths, self.planner.step()):
+                path.append(pos)
+            ticks += 1
+        return PartialPlan([array("i", path) for path in self.paths],
+                           self.planner.remaining_distances(),
+                           self.planner.finished)
@@ -0,0 +1,83 @@
+"""
+This module plans an LC-MAE evacuation with several random seeds at once and keeps the best plan
+"""
+import multiprocessing
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from evacsim.level import Level
+from .planner import AnytimePlanner
+
+CRITERIA = ("makespan", "p95")
+
+
+@dataclass
+class PortfolioPlan:
+    """The best plan found by plan_evacuation_portfolio()"""
+    seed: int
+    # Number of agents which never got to safety
+    unsafe: int
+    # The value of the criterion the plan was chosen by
+    score: float
+    paths: List[Sequence[int]]
+
+
+def plan_evacuation_portfolio(level: Level, seeds: int, criterion="makespan", target: Optional[float] = None,
+                              processes: Optional[int] = None, random_seed=42,
+                              sleep_radius: Optional[int] = 40) -> PortfolioPlan:
+    """Plan the evacuation with `seeds` consecutive random seeds in a process pool and return the best plan
+
+    Plans are compared by the number of agents which never got to safety
+    and then by the `criterion`, which is either the makespan or the 95th
+    percentile of the times in which agents got to safety. Ties go to the
+    lower seed. As soon as a plan gets everyone to safety with a score of at
+    most `target`, the other workers are stopped and that plan is returned.
+
+    The workers are forked, so that they share the already compiled level
+    instead of getting a copy of it. This only works where the fork start
+    method is available.
+    """
+    if criterion not in CRITERIA:
+        raise ValueError(f"Unknown criterion {criterion}")
+    context = multiprocessing.get_context("fork")
+    best: Optional[PortfolioPlan] = None
+    with context.Pool(processes, initializer=_init, initargs=(level, criterion, sleep_radius)) as pool:
+        for plan in pool.imap_unordered(_plan, range(random_seed, random_seed + seeds)):
+            if best is None or _rank(plan) < _rank(best):
+                best = plan
+            if target is not None and plan.unsafe == 0 and plan.score <= target:
+                # Leaving the with block terminates the other workers
+                break
+    assert best is not None
+    return best
+
+
+def _rank(plan: PortfolioPlan) -> Tuple[int, float, int]:
+    return plan.unsafe, plan.score, plan.seed
+
+
+# The worker's level and criteria, inherited from the parent process
+_level: Optional[Level] = None
+_criterion = ""
+_sleep_radius: Optional[int] = None
+
+
+def _init(level: Level, criterion: str, sleep_radius: Optional[int]):
+    global _level, _criterion, _sleep_radius
+    _level, _criterion, _sleep_radius = level, criterion, sleep_radius
+
+
+def _plan(seed: int) -> PortfolioPlan:
+    assert _level is not None
+    paths = AnytimePlanner(_level, random_seed=seed, debug=False, sleep_radius=_sleep_radius).plan().paths
+    makespan = len(paths[0]) if paths else 0
+    # Agents which never got to safety count as getting there after the plan ends
+    times = [next((t for t, pos in enumerate(path) if _level.is_safe(pos)), makespan) for path in paths]
+    unsafe = times.count(makespan)
+    if _criterion == "makespan" or not times:
+        score = float(makespan)
+    else:
+        score = float(np.percentile(times, 95))
+    return PortfolioPlan(seed, unsafe, score, paths)
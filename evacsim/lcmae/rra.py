@@ -1,20 +1,98 @@
-from evacsim.astar import AStar
-from evacsim.level import Level
-from evacsim.manhattan import ManhattanDistanceHeuristic
-from evacsim.graph.nx_graph import NxGraph, NxNode
+from collections import Counter, OrderedDict
+from typing import Dict, Optional, Union
 
+import numpy as np
 
-class RRAHeuristic(AStar):
-    def __init__(self, level: Level, position: NxNode, goal: NxNode):
+from evacsim.astar import GridAStar
+from evacsim.level import AgentType, Level
+
+
+class RRAHeuristic(GridAStar):
+    def __init__(self, level: Level, position: int, goal: int):
         self.level = level
-        super().__init__(NxGraph(level.g), ManhattanDistanceHeuristic(level).manhattan_distance, goal, position)
+        super().__init__(level.grid, goal, position)
 
-    def distance(self, position: NxNode) -> int:
-        if position not in self.closed:
+    def distance(self, position: int) -> int:
+        if not self.closed[position]:
             self.goal = position
             if not self.pathfind():
                 # This really should not happen due to construction
                 # of the rest of algorithms here
                 raise RuntimeError("{0} cannot be reached from {1}".format(
                     self.start, position))
-        return int(self.g_costs[position])
+        return self.g_costs[position]
+
+
+class RRATable:
+    """The distances of all cells from a goal, found by a single breadth-first search
+
+    It answers like an RRAHeuristic which has already explored everything,
+    so it's worth it for goals known to be shared by many agents.
+    """
+
+    def __init__(self, level: Level, goal: int):
+        self.start = goal
+        distances, _ = level.grid.bfs(np.array([goal], dtype=np.int64))
+        self.distances = memoryview(distances)
+
+    def distance(self, position: int) -> int:
+        distance = self.distances[position]
+        if distance < 0:
+            raise RuntimeError("{0} cannot be reached from {1}".format(self.start, position))
+        return distance
+
+
+class RRACache:
+    """RRA* searches shared by all agents heading to the same goal
+
+    A search is kept while at least one agent heads to its goal. After the
+    last one leaves, it's kept around in case another agent picks the same
+    goal, until the searches together hold more per-cell state than the
+    budget allows. Every search keeps its state in arrays covering the whole
+    grid, however little of it it has explored, so each of them is charged
+    the grid's size. Then the least recently abandoned searches are dropped.
+
+    The targets of the scenario's static agents are known up front and
+    are usually shared by many of them, so their distances are found by a
+    breadth-first search of the whole grid (see RRATable) instead.
+    """
+
+    def __init__(self, level: Level, budget: Optional[int] = None):
+        self.level = level
+        # By default, the searches may hold a few grids' worth of state
+        self.budget = budget if budget is not None else 4 * level.grid.size
+        self.searches: Dict[int, Union[RRAHeuristic, RRATable]] = {}
+        self.static_targets = {agent.goal for agent in level.scenario.agents if agent.type == AgentType.STATIC}
+        self.users: Counter = Counter()
+        # Goals no agent heads to, from the least recently abandoned
+        self.idle: OrderedDict = OrderedDict()
+
+    def acquire(self, goal: int) -> Union[RRAHeuristic, RRATable]:
+        """Return the search for the given goal, which the caller has to release() when done with it"""
+        search = self.searches.get(goal)
+        if search is None:
+            if goal in self.static_targets:
+                search = RRATable(self.level, goal)
+            else:
+                search = RRAHeuristic(self.level, goal, goal)
+            self.searches[goal] = search
+            self._evict()
+        self.idle.pop(goal, None)
+        self.users[goal] += 1
+        return search
+
+    def release(self, goal: int):
+        self.users[goal] -= 1
+        if self.users[goal] == 0:
+            del self.users[goal]
+            self.idle[goal] = None
+            self._evict()
+
+    def size(self) -> int:
+        """Return the number of cells all the searches hold state for"""
+        return len(self.searches) * self.level.grid.size
+
+    def _evict(self):
+        while self.idle and self.size() > self.budget:
+            goal, _ = self.idle.popitem(last=False)
+            del self.searches[goal]
@@ -0,0 +1,82 @@
+from collections import defaultdict
+from typing import DefaultDict, Dict, Iterable, List, Set, Tuple
+
+from evacsim.level import Level
+from .agent import Agent
+
+Bucket = Tuple[int, int]
+
+
+class SleepScheduler:
+    """Keeps safe agents away from the action from being stepped on every timestep
+
+    Safe agents only surf to make room for the agents still arriving from
+    the danger, so those with no endangered or recently rescued agent within
+    `radius` are put to sleep: their reservations are replaced with a
+    standing one of their current cell and they are not stepped until an
+    active agent comes within the radius again. Then they catch up with the
+    rest of the swarm and start surfing again. Agents count as recently
+    rescued for `radius` timesteps after reaching safety, since they keep
+    pushing into the crowd in front of them.
+
+    The radius has to be larger than the agents' lookahead, so that
+    sleepers are woken before endangered agents plan paths through them.
+    Agents are found by splitting the map into square buckets with sides
+    of half the radius, waking up everyone in the buckets at most two
+    buckets away from an active agent's one.
+    """
+
+    def __init__(self, level: Level, radius: int):
+        self.cols = level.cols
+        self.radius = radius
+        # Anything within the radius is at most two buckets away
+        self.side = max(1, (radius + 1) // 2)
+        self.sleeping: DefaultDict[Bucket, Dict[int, Agent]] = defaultdict(dict)
+        # The last timestep in which each recently endangered agent was endangered
+        self.endangered_at: Dict[int, int] = {}
+
+    def schedule(self, safe: List[Agent], endangered: List[Agent], t: int) -> List[Agent]:
+        """Update the sleeping agents before timestep `t` and return the safe agents which are awake
+
+        Woken agents plan their paths right away, before any endangered
+        agent plans in timestep `t`.
+        """
+        for agent in endangered:
+            self.endangered_at[agent.id] = t
+        arrivals = [agent for agent in safe if agent.id in self.endangered_at]
+        for agent in arrivals:
+            if self.endangered_at[agent.id] < t - self.radius:
+                del self.endangered_at[agent.id]
+        around = self._around(endangered) | self._around(arrivals)
+        awake = []
+        for agent in safe:
+            bucket = self._bucket(agent.pos.position)
+            if bucket not in around:
+                agent.fall_asleep()
+                self.sleeping[bucket][agent.id] = agent
+            else:
+                awake.append(agent)
+        for bucket in around:
+            sleepers = self.sleeping.pop(bucket, None)
+            if sleepers:
+                for agent in sleepers.values():
+                    agent.wake_up(t)
+                    awake.append(agent)
+        return awake
+
+    def remove(self, agent: Agent) -> bool:
+        """Stop scheduling the agent, without waking it up, and return whether it was asleep"""
+        self.endangered_at.pop(agent.id, None)
+        sleepers = self.sleeping.get(self._bucket(agent.pos.position))
+        return sleepers is not None and sleepers.pop(agent.id, None) is not None
+
+    def _bucket(self, pos: int) -> Bucket:
+        row, col = divmod(pos, self.cols)
+        return row // self.side, col // self.side
+
+    def _around(self, agents: Iterable[Agent]) -> Set[Bucket]:
+        buckets = set()
+        for agent in agents:
+            row, col = self._bucket(agent.pos.position)
+            buckets.update((row + dr, col + dc) for dr in range(-2, 3) for dc in range(-2, 3))
+        return buckets
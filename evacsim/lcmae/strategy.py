@@ -10,3 +10,7 @@ class Strategy(ABC):
     @abstractmethod
     def name(self) -> str:
         raise NotImplementedError()
+
+    def finish(self):
+        """Release resources held by the strategy when the agent stops using it"""
+        pass
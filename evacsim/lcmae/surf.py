@@ -1,6 +1,6 @@
 import typing
-from collections import deque
-from pqdict import pqdict
+from collections import Counter, deque
+from heapq import heappop, heappush
 
 from .strategy import Strategy
 from evacsim.graph.reservation_graph import ReservationNode, Reservation
@@ -10,72 +10,84 @@ class Surfing(Strategy):
     def __init__(self, agent):
         self.agent = agent
         self.lookback = self.agent.lookahead // 2
-        self.lookback_set = set()
+        # Cells visited in the last few lookaheads, which are more expensive
+        # to move into again, with the number of visits to each
+        self.recent: typing.Deque[int] = deque(maxlen=4 * self.agent.lookahead)
+        self.lookback_set: typing.Counter[int] = Counter()
         self.reservation_len = self.agent.lookahead // 2
         self.replan()
 
     def pathfind(self) -> typing.Optional[typing.List[ReservationNode]]:
-        opened = pqdict({self.agent.pos: 0})
-        closed: typing.Set[ReservationNode] = set()
-        g_costs = {self.agent.pos: 0.0}
-        predecessors: typing.Dict[ReservationNode, ReservationNode] = {}
+        # The search's state lives in the arena's slots, see SearchArena
+        arena = self.agent.search_arena
+        depth = self.agent.lookahead
+        generation = arena.reset(self.agent.pos.position, depth)
+        seen, closed, g_costs, predecessors = arena.seen, arena.closed, arena.g_costs, arena.predecessors
+        opened = arena.opened
+        successor_offsets = arena.successor_offsets
+        start_slot = arena.slot(self.agent.pos.position, 0)
+        seen[start_slot] = generation
+        g_costs[start_slot] = 0
+        predecessors[start_slot] = -1
         previously_reserved = self._previous_reserved()
         agent_t = self.agent.pos.t
+        # Nodes with the same f-cost are expanded in the order they were found
+        pushed = 0
+        opened.append((0, pushed, start_slot, self.agent.pos.position, 0))
         while opened:
-            curr = opened.pop()
-            closed.add(curr)
-            if curr.t == self.agent.pos.t + self.agent.lookahead:
-                path = [curr]
-                while path[-1] in predecessors:
-                    path.append(predecessors[path[-1]])
+            _, _, curr, pos, layer = heappop(opened)
+            if closed[curr] == generation:
+                continue
+            closed[curr] = generation
+            if layer == depth:
+                path = []
+                while curr != -1:
+                    pos, layer = arena.node(curr)
+                    path.append(ReservationNode(pos, agent_t + layer))
+                    curr = predecessors[curr]
                 path.reverse()
                 return path
             # As we go into the future, backpressure decreases, so that
             # it gradually becomes cheaper for agents to stay put
-            backpressure = max(1, previously_reserved - (curr.t - agent_t))
-            for (n, cost) in self.neighbors(curr, backpressure):
-                if n in closed:
+            backpressure = max(1, previously_reserved - layer)
+            layer += 1
+            for (n_pos, cost) in self.neighbors(pos, agent_t + layer, backpressure):
+                n = curr + successor_offsets[n_pos - pos]
+                if closed[n] == generation:
                     continue
                 considered_g_cost = g_costs[curr] + cost
-                if considered_g_cost >= g_costs.get(n, float("nan")):
+                if seen[n] == generation and considered_g_cost >= g_costs[n]:
                     continue
+                seen[n] = generation
                 g_costs[n] = considered_g_cost
                 predecessors[n] = curr
                 # Hm.
-                f_cost = (considered_g_cost + (self.agent.pos.t + self.agent.lookahead - n.t))
-                if n not in opened:
-                    opened.additem(n, f_cost)
-                else:
-                    opened[n] = f_cost
+                f_cost = considered_g_cost + depth - layer
+                pushed += 1
+                heappush(opened, (f_cost, pushed, n, n_pos, layer))
         return None
 
-    def neighbors(self, n: ReservationNode, bp_factor: int) -> typing.List[typing.Tuple[ReservationNode, int]]:
+    def neighbors(self, pos: int, t: int, bp_factor: int) -> typing.List[typing.Tuple[int, int]]:
+        """Return the positions reachable from `pos` at `t` and the costs of moving there"""
         neighbors = []
-        for k in self.agent.reservations.g[n.pos()].keys():
-            rn = ReservationNode(k, n.t + 1)
-            if self._reservable_by(rn) and self._reservable_by(rn.incremented_t()) and self.agent.level.is_safe(rn.pos()):
+        reservable_by = self.agent.reservations.reservable_by
+        agent = self.agent.id
+        is_dangerous = self.agent.level.grid.is_dangerous
+        for k in self.agent.level.grid.adjacent(pos):
+            if reservable_by(k, t, agent, 1) and reservable_by(k, t + 1, agent, 1) and not is_dangerous(k):
                 cost = 2
-                if rn.pos() in self.lookback_set:
+                if k in self.lookback_set:
                     cost = 3
-                neighbors.append((rn, cost))
-        this_node = n.incremented_t()
-        this_reservable = (self._reservable_by(this_node) and self._reservable_by(this_node.incremented_t()))
-        if this_node == ReservationNode(1107, 140):
-            self.agent.log("Considering as tn")
+                neighbors.append((k, cost))
+        this_reservable = reservable_by(pos, t, agent, 1) and reservable_by(pos, t + 1, agent, 1)
         if this_reservable:
-            neighbors.append((this_node, 1 * bp_factor))
+            neighbors.append((pos, 1 * bp_factor))
         else:
             # Agent can always break another agent's reservation of the node
             # they're currently on, but the action is penalized
-            neighbors.append((this_node, 4 * bp_factor))
-        if self.agent.id == 269 and self.agent.pos.t == 139:
-            self.agent.log(neighbors)
+            neighbors.append((pos, 4 * bp_factor))
         return neighbors
 
-    def _reservable_by(self, node: ReservationNode) -> bool:
-        reservation = self.agent.reservations.get(node)
-        return reservation is None or reservation.agent == self.agent.id or reservation.priority < 1
-
     def _previous_reserved(self) -> int:
         reserved = 0
         t = self.agent.pos.t
@@ -87,7 +99,7 @@ class Surfing(Strategy):
     def replan(self):
         self.agent.cancel_reservations()
         self.agent.next_path = deque(self.pathfind()[1:])
-        self.agent.log(f"bp={self._previous_reserved()} Next: {self.agent.next_path}")
+        self.agent.log("plan", path=self.agent.next_path, backpressure=self._previous_reserved)
         self.agent.reserve_next_path(priorities=[2] * self.reservation_len + [1] * self.reservation_len)
 
     def step(self) -> ReservationNode:
@@ -97,8 +109,17 @@ class Surfing(Strategy):
         # on each move instead of slowly being used-up until the next search.
         self.agent.reservations.reserve(Reservation(self.agent.next_path[self.reservation_len], self.agent.id, 2))
         next_node = self.agent.next_path.popleft()
-        self.lookback_set.add(next_node.pos())
+        self._remember(next_node.pos())
         return next_node
 
+    def _remember(self, pos: int):
+        if len(self.recent) == self.recent.maxlen:
+            forgotten = self.recent[0]
+            self.lookback_set[forgotten] -= 1
+            if not self.lookback_set[forgotten]:
+                del self.lookback_set[forgotten]
+        self.recent.append(pos)
+        self.lookback_set[pos] += 1
+
     def name(self) -> str:
         return "s"
@@ -0,0 +1,35 @@
+"""
+This module implements structured tracing of the agents' decisions
+"""
+import json
+from typing import Any, Dict, TextIO
+
+DEBUG = 10
+INFO = 20
+WARN = 30
+LEVELS = {"debug": DEBUG, "info": INFO, "warn": WARN}
+_LEVEL_NAMES = {level: name for name, level in LEVELS.items()}
+
+
+class Tracer:
+    """Writes trace events into a text sink, as JSON lines
+
+    Every event has a level, the agent and timestep it happened at, its type
+    and a payload. Agents check the level before building an event, so
+    events below the tracer's level cost next to nothing and agents without
+    a tracer don't trace at all.
+
+    Payload values are only formatted when the event is written. Callables
+    are called then, and other values which aren't JSON types (like paths)
+    are written as lists, so ReservationNodes become [position, t] pairs.
+    """
+
+    def __init__(self, sink: TextIO, level=DEBUG):
+        self.sink = sink
+        self.level = level
+
+    def emit(self, level: int, agent: int, t: int, event: str, payload: Dict[str, Any]):
+        record = {"level": _LEVEL_NAMES.get(level, level), "agent": agent, "t": t, "event": event}
+        for key, value in payload.items():
+            record[key] = value() if callable(value) else value
+        self.sink.write(json.dumps(record, default=list) + "\n")
@@ -0,0 +1,47 @@
+from array import array
+from typing import List, Union
+
+from evacsim.graph.reservation_graph import ReservationNode
+
+
+class Trajectory:
+    """The path an agent has taken, kept as a typed array of positions
+
+    It behaves like a list of consecutive ReservationNodes, but only the
+    last node is kept as an object. The others are created when indexed.
+    forget() drops old nodes, which then no longer count towards the length
+    and can't be indexed anymore.
+    """
+
+    def __init__(self, origin: int, t=0):
+        # The timestep of the oldest kept node
+        self.start = t
+        self.positions = array("i", [origin])
+        self.last = ReservationNode(origin, t)
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[ReservationNode, List[ReservationNode]]:
+        if isinstance(i, slice):
+            return [ReservationNode(self.positions[j], self.start + j) for j in range(*i.indices(len(self.positions)))]
+        if i < 0:
+            i += len(self.positions)
+        return ReservationNode(self.positions[i], self.start + i)
+
+    def append(self, node: ReservationNode):
+        """Add the node for the timestep after the last one"""
+        self.positions.append(node.position)
+        self.last = node
+
+    def relocate(self, position: int):
+        """Replace the position of the last node"""
+        self.positions[-1] = position
+        self.last = ReservationNode(position, self.last.t)
+
+    def forget(self, keep: int):
+        """Drop all but the last `keep` nodes"""
+        dropped = len(self.positions) - keep
+        if dropped > 0:
+            del self.positions[:dropped]
+            self.start += dropped
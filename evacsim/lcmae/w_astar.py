@@ -1,76 +1,89 @@
 import typing
-from pqdict import pqdict
+from heapq import heappop, heappush
 from evacsim.graph.reservation_graph import ReservationGraph, ReservationNode
+from .arena import SearchArena
 
 
 class WindowedAstar:
     def __init__(self,
                  g: ReservationGraph,
                  agent,
-                 rra: typing.Callable[[ReservationNode, ReservationNode], int],
+                 rra: typing.Callable[[int], int],
                  start: ReservationNode,
                  goal: ReservationNode,
                  depth: int,
+                 arena: SearchArena,
                  reservation_priority=2):
         self.g = g
+        self.grid = agent.level.grid
         self.agent = agent
         self.rra = rra
         self.start = start
         self.goal = goal
         self.depth = depth
-        self.opened = pqdict({start: rra(start, goal)})
-        self.closed: typing.Set[ReservationNode] = set()
-        self.g_costs = {start: 0.0}
-        self.last_node: typing.Optional[ReservationNode] = None
-        self.predecessors: typing.Dict[ReservationNode, ReservationNode] = {}
+        self.arena = arena
+        self.last_slot: typing.Optional[int] = None
         self.priority = reservation_priority
 
     def pathfind(self) -> bool:
-        while self.opened:
-            curr = self.opened.pop()
-            self.closed.add(curr)
-            if curr.t == self.start.t + self.depth:
-                self.last_node = curr
+        # The search's state lives in the arena's slots, see SearchArena
+        arena = self.arena
+        generation = arena.reset(self.start.position, self.depth)
+        seen, closed, g_costs, predecessors = arena.seen, arena.closed, arena.g_costs, arena.predecessors
+        opened = arena.opened
+        successor_offsets = arena.successor_offsets
+        start_slot = arena.slot(self.start.position, 0)
+        seen[start_slot] = generation
+        g_costs[start_slot] = 0
+        predecessors[start_slot] = -1
+        # Nodes with the same f-cost are expanded in the order they were found
+        pushed = 0
+        opened.append((self.rra(self.start.position), pushed, start_slot, self.start.position, 0))
+        while opened:
+            _, _, curr, pos, layer = heappop(opened)
+            if closed[curr] == generation:
+                continue
+            closed[curr] = generation
+            if layer == self.depth:
+                self.last_slot = curr
                 return True
-            for (n, cost) in self.neighbors(curr):
-                if n in self.closed:
+            layer += 1
+            for (n_pos, cost) in self.neighbors(pos, self.start.t + layer):
+                n = curr + successor_offsets[n_pos - pos]
+                if closed[n] == generation:
                     continue
-                considered_g_cost = self.g_costs[curr] + cost
-                if considered_g_cost >= self.g_costs.get(n, float("nan")):
+                considered_g_cost = g_costs[curr] + cost
+                if seen[n] == generation and considered_g_cost >= g_costs[n]:
                     continue
-                self.g_costs[n] = considered_g_cost
-                self.predecessors[n] = curr
-                f_cost = (considered_g_cost +
-                          self.rra(n, self.goal))
-                if n not in self.opened:
-                    self.opened.additem(n, f_cost)
-                else:
-                    self.opened[n] = f_cost
+                seen[n] = generation
+                g_costs[n] = considered_g_cost
+                predecessors[n] = curr
+                pushed += 1
+                heappush(opened, (considered_g_cost + self.rra(n_pos), pushed, n, n_pos, layer))
         return False
 
-    def neighbors(self, n: ReservationNode) -> typing.List[typing.Tuple[ReservationNode, int]]:
+    def neighbors(self, pos: int, t: int) -> typing.List[typing.Tuple[int, int]]:
+        """Return the positions reachable from `pos` at `t` and the costs of moving there"""
         neighbors = []
-        for k in self.g.g[n.pos()].keys():
-            rn = ReservationNode(k, n.t + 1)
-            if self._reservable_by(rn) and self._reservable_by(rn.incremented_t()):
-                neighbors.append((rn, 1))
-        this_node = n.incremented_t()
-        this_reservable = (self._reservable_by(this_node) and self._reservable_by(this_node.incremented_t()))
-        if this_reservable:
-            neighbors.append((this_node, 1))
+        reservable_by = self.g.reservable_by
+        agent, priority = self.agent.id, self.priority
+        for k in self.grid.adjacent(pos):
+            if reservable_by(k, t, agent, priority) and reservable_by(k, t + 1, agent, priority):
+                neighbors.append((k, 1))
+        if reservable_by(pos, t, agent, priority) and reservable_by(pos, t + 1, agent, priority):
+            neighbors.append((pos, 1))
         else:
             # Agent can always break another agent's reservation of the node
             # they're currently on, but the action is penalized
-            neighbors.append((this_node, 2))
+            neighbors.append((pos, 2))
         return neighbors
 
     def reconstruct_path(self) -> typing.List[ReservationNode]:
-        path = [self.last_node]
-        while path[-1] in self.predecessors:
-            path.append(self.predecessors[path[-1]])
+        path = []
+        slot = self.last_slot
+        while slot != -1:
+            pos, layer = self.arena.node(slot)
+            path.append(ReservationNode(pos, self.start.t + layer))
+            slot = self.arena.predecessors[slot]
         path.reverse()
-        return typing.cast(typing.List[ReservationNode], path)
-
-    def _reservable_by(self, node: ReservationNode) -> bool:
-        reservation = self.g.get(node)
-        return reservation is None or reservation.agent == self.agent.id or reservation.priority < self.priority
+        return path
@@ -1,7 +1,16 @@
+import copy
+import hashlib
+import os
 import re
+import shutil
+import tempfile
 from enum import Enum
-from typing import List, Tuple, NamedTuple
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, NamedTuple
 import networkx as nx
+import numpy as np
+
+from .graph.grid_graph import GridGraph
 
 
 def coords_to_id(cols, row, col):
@@ -31,7 +40,7 @@ class Agent(NamedTuple):
 
 
 class Scenario:
-    agent_re = re.compile("(\\d+)(.)(\\d+)?")
+    agent_re = re.compile("(\\d+)([^\\d\\s])(\\d*)")
     _typeMap = {"r": AgentType.RETARGETING, "f": AgentType.CLOSEST_FRONTIER, "s": AgentType.STATIC, "p": AgentType.PANICKED}
     _typeChars = {typ: code for code, typ in _typeMap.items()}
 
@@ -40,22 +49,28 @@ class Scenario:
         with open(path, "r") as f:
             s = Scenario([], [])
             danger_line = f.readline().strip()
-            s.danger = list(
-                map(int, danger_line.split(" "))) if danger_line != "" else []
-            agents_line = f.readline().strip().split(" ")
-            if agents_line == [""]:
-                return s
-            for agent_desc in agents_line:
-                parsed_desc = Scenario.agent_re.fullmatch(agent_desc)
-                s.agents.append(Agent(
-                    Scenario._typeMap[parsed_desc[2]],
-                    int(parsed_desc[1]),
-                    int(parsed_desc[3]) if parsed_desc[3] is not None else None))
+            if danger_line != "":
+                s.danger = np.fromstring(danger_line, dtype=np.int64, sep=" ").tolist()
+            # All agents are matched in a single pass over the line
+            s.agents = [
+                Agent(Scenario._typeMap[typ], int(origin), int(goal) if goal else None)
+                for origin, typ, goal in Scenario.agent_re.findall(f.readline())]
+            for line in f:
+                if line.strip() == "":
+                    continue
+                t, _, cells = line.partition(":")
+                s.spread.setdefault(int(t), []).extend(map(int, cells.split()))
             return s
 
-    def __init__(self, danger, agents):
+    def __init__(self, danger, agents, spread=None):
         self.agents: List[Agent] = agents
         self.danger: List[int] = danger
+        # Cells becoming dangerous later, by the timestep from which they are dangerous
+        self.spread: Dict[int, List[int]] = spread if spread is not None else {}
+
+    def spreads_from(self, t: int) -> bool:
+        """Check whether any danger spreads in timestep `t` or later"""
+        return any(when >= t for when in self.spread)
 
     def danger_coords(self, map_cols: int) -> List[Tuple[int, int]]:
         return list(
@@ -74,18 +89,52 @@ class Scenario:
     def write(self, f):
         print(*self.danger, file=f)
         print(*map(lambda a: self.agent_str(a), self.agents), file=f)
+        for t, cells in sorted(self.spread.items()):
+            print(f"{t}:", *cells, file=f)
+
+
+CACHE_DIR_ENV = "EVACSIM_CACHE_DIR"
 
 
 class Level:
-    def __init__(self, map_path: str, scenario_path: str):
-        with open(map_path) as map_f:
-            self.__parse_header(map_f)
-            self.__parse_map(map_f)
+    def __init__(self, map_path: str, scenario_path: str, cache_dir: Optional[str] = None):
+        """Load a level from a map and a scenario file
+
+        If a cache directory is given (or set in the EVACSIM_CACHE_DIR
+        environment variable), the compiled level is saved into it and later
+        loads of the same map and scenario memory-map it instead of parsing
+        the files again.
+        """
+        self.__frontier_field: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        cache_dir = cache_dir or os.environ.get(CACHE_DIR_ENV)
+        cache = LevelCache(cache_dir, map_path, scenario_path) if cache_dir else None
+        compiled_map = cache.load_map() if cache else None
+        if compiled_map is None:
+            with open(map_path) as map_f:
+                self.__parse_header(map_f)
+                passable = self.__parse_map(map_f).reshape(self.rows, self.cols)
+            indptr, indices = GridGraph.link(self.rows, self.cols, passable)
+            if cache:
+                cache.save_map(passable=passable, indptr=indptr, indices=indices)
+        else:
+            passable, indptr, indices = compiled_map
+            self.rows, self.cols = passable.shape
+        compiled_scenario = cache.load_scenario() if cache else None
+        if compiled_scenario is None:
             self.scenario = Scenario.from_file(scenario_path)
-            self.__add_danger()
+            dangerous = self.__danger_mask()
+        else:
+            self.scenario, dangerous, self.frontier = compiled_scenario
+        self.grid = GridGraph(self.rows, self.cols, indptr, indices, passable.reshape(-1), dangerous)
+        if compiled_scenario is None:
             self.__add_frontier()
-            for n in self.g.nodes:
-                self.g.nodes[n]["reservations"] = set()
+            if cache:
+                cache.save_scenario(self.scenario, self.grid.dangerous, self.frontier)
+
+    @property
+    def g(self) -> nx.Graph:
+        """A networkx view of the level's graph, built on first use"""
+        return self.grid.as_networkx()
 
     def coords_to_id(self, row, col):
         return coords_to_id(self.cols, row, col)
@@ -94,47 +143,89 @@ class Level:
         return id_to_coords(self.cols, node_id)
 
     def is_safe(self, node_id) -> bool:
-        return not self.g.nodes[node_id]["dangerous"]
+        return not self.grid.is_dangerous(node_id)
+
+    def closest_frontier(self, node_id) -> Optional[Tuple[int, int]]:
+        """Return the frontier node closest to the given one and the distance to it
 
-    def __add_danger(self):
-        for n in self.scenario.danger:
-            if n in self.g.nodes:
-                self.g.nodes[n]["dangerous"] = True
+        The distances from the frontier are computed by a single search on
+        first use and shared by all later calls. When the danger spreads,
+        add_danger() repairs them.
+        """
+        if self.__frontier_field is None:
+            self.__frontier_field = self.grid.bfs(np.array(self.frontier, dtype=np.int64))
+        distances, labels = self.__frontier_field
+        if distances[node_id] < 0:
+            return None
+        return int(labels[node_id]), int(distances[node_id])
+
+    def copy(self) -> "Level":
+        """Return a copy of the level whose danger and agents can change without affecting this one
+
+        The map's arrays are shared. The danger mask is shared too, until
+        the copy's danger changes (see GridGraph.add_danger()).
+        """
+        level = copy.copy(self)
+        level.grid = copy.copy(self.grid)
+        level.scenario = Scenario(list(self.scenario.danger), list(self.scenario.agents),
+                                  {t: list(cells) for t, cells in self.scenario.spread.items()})
+        level.frontier = list(self.frontier)
+        if self.__frontier_field is not None:
+            distances, labels = self.__frontier_field
+            level.__frontier_field = distances.copy(), labels.copy()
+        return level
+
+    def add_danger(self, cells: Sequence[int]) -> Tuple[List[int], np.ndarray]:
+        """Make the given cells dangerous
+
+        Return the cells which weren't dangerous before and the cells whose
+        closest frontier node or distance from it has changed. Only the new
+        danger and its neighbors can enter or leave the frontier, so it's
+        updated around them, and the distances from the frontier are
+        repaired where they changed instead of being searched again.
+        """
+        new = self.grid.add_danger(np.asarray(cells, dtype=np.int64)).tolist()
+        if not new:
+            return new, np.zeros(0, dtype=np.int64)
+        self.scenario.danger.extend(new)
+        frontier = set(self.frontier)
+        removed = frontier.intersection(new)
+        frontier.difference_update(removed)
+        added = set()
+        for pos in new:
+            added.update(n for n in self.grid.adjacent(pos) if not self.grid.is_dangerous(n) and n not in frontier)
+        frontier.update(added)
+        self.frontier = sorted(frontier)
+        if self.__frontier_field is None:
+            # Nobody has looked for the frontier yet
+            return new, np.zeros(0, dtype=np.int64)
+        distances, labels = self.__frontier_field
+        return new, self.grid.repair_bfs(distances, labels, sorted(removed), sorted(added))
+
+    def __danger_mask(self) -> np.ndarray:
+        dangerous = np.zeros(self.rows * self.cols, dtype=bool)
+        danger = np.asarray(self.scenario.danger, dtype=np.int64)
+        dangerous[danger[(danger >= 0) & (danger < len(dangerous))]] = True
+        return dangerous
 
     def __add_frontier(self):
-        self.frontier = []
-        for (u, v) in self.g.edges:
-            if self.g.nodes[u]["dangerous"] != self.g.nodes[v]["dangerous"]:
-                if not self.g.nodes[u]["dangerous"]:
-                    self.frontier.append(u)
-                else:
-                    self.frontier.append(v)
-
-    def __parse_map(self, f):
-        grid = f.readlines()
-        self.g = nx.Graph()
-        self.g.graph["rows"] = self.rows
-        self.g.graph["cols"] = self.cols
-        for row, row_data in enumerate(grid):
-            for col, field in enumerate(row_data.strip()):
-                if field == "@":
-                    continue
-                field_id = coords_to_id(self.cols, row, col)
-                self.g.add_node(field_id)
-                self.g.nodes[field_id]["dangerous"] = False
-                if row != 0 and grid[row - 1][col] != "@":
-                    self.g.add_edge(
-                        field_id, coords_to_id(self.cols, row - 1, col))
-                if row != self.rows - 1 and grid[row + 1][col] != "@":
-                    self.g.add_edge(
-                        field_id, coords_to_id(self.cols, row + 1, col))
-                if col != 0 and grid[row][col - 1] != "@":
-                    self.g.add_edge(
-                        field_id, coords_to_id(self.cols, row, col - 1))
-                if col != self.cols - 1 and grid[row][col + 1] != "@":
-                    self.g.add_edge(
-                        field_id, coords_to_id(self.cols, row, col + 1))
-        return self.g
+        """Find all safe nodes neighboring dangerous ones"""
+        dangerous = self.grid.dangerous.reshape(self.rows, self.cols)
+        near_danger = np.zeros_like(dangerous)
+        near_danger[1:] |= dangerous[:-1]
+        near_danger[:-1] |= dangerous[1:]
+        near_danger[:, 1:] |= dangerous[:, :-1]
+        near_danger[:, :-1] |= dangerous[:, 1:]
+        safe = self.grid.passable & ~self.grid.dangerous
+        self.frontier: List[int] = np.flatnonzero(safe & near_danger.reshape(-1)).tolist()
+
+    def __parse_map(self, f) -> np.ndarray:
+        """Return a mask of the passable cells, in row-major order"""
+        # Missing cells at the ends of short lines are treated as walls
+        lines = (line.strip().encode().ljust(self.cols, b"@")[:self.cols]
+                 for line in f.read().splitlines()[:self.rows])
+        body = b"".join(lines).ljust(self.rows * self.cols, b"@")
+        return np.frombuffer(body, dtype=np.uint8) != ord("@")
 
     def __parse_header(self, f):
         if f.readline().strip() != "type octile":
@@ -143,3 +234,79 @@ class Level:
         self.cols = int(f.readline().strip().split(" ")[1])
         if f.readline().strip() != "map":
             raise ParseError("Invalid map header end")
+
+
+class LevelCache:
+    """A directory with compiled levels
+
+    Every map gets a directory named after a hash of its contents, holding
+    its passability mask and CSR graph, and each scenario played on the map
+    gets a subdirectory of it named after the scenario's hash, holding its
+    agents, danger, spreading danger and frontier. All arrays are stored in separate `.npy`
+    files, so that they can be memory-mapped when loaded.
+    """
+    VERSION = 2
+
+    def __init__(self, root: str, map_path: str, scenario_path: str):
+        self.root = Path(root)
+        self.map_dir = self.root.joinpath(f"map-v{LevelCache.VERSION}-{_digest(map_path)}")
+        self.scenario_dir = self.map_dir.joinpath(f"scen-{_digest(scenario_path)}")
+
+    def load_map(self) -> Optional[List[np.ndarray]]:
+        """Return the passability mask and CSR arrays (indptr, indices) of the map, if cached"""
+        return LevelCache.__load(self.map_dir, ("passable", "indptr", "indices"))
+
+    def save_map(self, **arrays: np.ndarray):
+        LevelCache.__save(self.root, self.map_dir, arrays)
+
+    def load_scenario(self) -> Optional[Tuple[Scenario, np.ndarray, List[int]]]:
+        """Return the scenario, its danger mask and frontier, if cached"""
+        arrays = LevelCache.__load(self.scenario_dir, ("danger", "agents", "spread", "dangerous", "frontier"))
+        if arrays is None:
+            return None
+        danger, agents, spread, dangerous, frontier = arrays
+        types = {typ.value: typ for typ in AgentType}
+        scenario = Scenario(danger.tolist(), [
+            Agent(types[typ], origin, goal if goal >= 0 else None)
+            for typ, origin, goal in agents.tolist()])
+        for t, cell in spread.tolist():
+            scenario.spread.setdefault(t, []).append(cell)
+        return scenario, dangerous, frontier.tolist()
+
+    def save_scenario(self, scenario: Scenario, dangerous: np.ndarray, frontier: List[int]):
+        agents = np.array([
+            (agent.type.value, agent.origin, agent.goal if agent.goal is not None else -1)
+            for agent in scenario.agents], dtype=np.int64).reshape(-1, 3)
+        LevelCache.__save(self.map_dir, self.scenario_dir, {
+            "danger": np.asarray(scenario.danger, dtype=np.int64),
+            "agents": agents,
+            "spread": np.array([(t, cell) for t, cells in sorted(scenario.spread.items()) for cell in cells],
+                               dtype=np.int64).reshape(-1, 2),
+            "dangerous": dangerous,
+            "frontier": np.asarray(frontier, dtype=np.int64),
+        })
+
+    @staticmethod
+    def __load(directory: Path, names: Tuple[str, ...]) -> Optional[List[np.ndarray]]:
+        if not directory.is_dir():
+            return None
+        return [np.load(directory.joinpath(f"{name}.npy"), mmap_mode="r") for name in names]
+
+    @staticmethod
+    def __save(parent: Path, directory: Path, arrays: Dict[str, np.ndarray]):
+        # The arrays are written into a temporary directory which is then
+        # renamed, so that other processes never see an incomplete entry
+        parent.mkdir(parents=True, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), array)
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            # Someone else has cached the same entry in the meantime
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
@@ -0,0 +1,120 @@
+"""
+This module contains micro-benchmarks of the planners' hot paths.
+
+Unlike the `bench` module, which evaluates complete evacuation plans, the
+functions in here time isolated building blocks of the planners on a given
+level, so that changes to them can be measured without the noise of a whole
+planning run.
+"""
+import os
+from random import Random
+from time import perf_counter
+from typing import Callable, Dict
+
+import evacsim.lcmae as lcmae
+from .astar import AStar, GridAStar
+from .graph.nx_graph import NxNode
+from .graph.reservation_graph import ReservationGraph, ReservationNode, Reservation
+from .level import Level
+from .manhattan import ManhattanDistanceHeuristic
+
+
+def reservations(level: Level, ticks=200, window=10) -> Dict[str, float]:
+    """Time the reservation table on an access pattern resembling LC-MAE's
+
+    Every agent from the scenario reserves and cancels a window of nodes
+    (and their t+1 twins) on each tick and checks reservability of all its
+    neighbors within the window, just like the windowed searches do.
+    """
+    rng = Random(42)
+    table = ReservationGraph(level.grid)
+    nodes = level.grid.nodes().tolist()
+    positions = [agent.origin for agent in level.scenario.agents]
+    gets = reserves = cancels = 0
+    start = perf_counter()
+    for t in range(ticks):
+        table.expire(t)
+        for agent, pos in enumerate(positions):
+            path = []
+            for i in range(window):
+                for k in level.grid.adjacent(pos):
+                    table.get(ReservationNode(k, t + i + 1))
+                    table.get(ReservationNode(k, t + i + 2))
+                    gets += 2
+                path.append(ReservationNode(pos, t + i))
+            for node in path:
+                table.reserve(Reservation(node, agent, 2))
+                table.reserve(Reservation(node.incremented_t(), agent, 2))
+                reserves += 2
+            for node in path:
+                table.cancel_reservation(node)
+                table.cancel_reservation(node.incremented_t())
+                cancels += 2
+            positions[agent] = rng.choice(nodes)
+    elapsed = perf_counter() - start
+    return {
+        "operations": gets + reserves + cancels,
+        "time": elapsed,
+        "ns_per_operation": elapsed * 1e9 / (gets + reserves + cancels),
+        "lcmae_planning_time": _timed(lambda: lcmae.plan_evacuation(level, debug=False)),
+    }
+
+
+def search(level: Level, searches=200) -> Dict[str, float]:
+    """Time A* searches between random pairs of nodes
+
+    The same pairs are searched for by the generic AStar on Node objects
+    and by the GridAStar working on cell IDs.
+    """
+    rng = Random(42)
+    nodes = level.grid.nodes().tolist()
+    pairs = [(rng.choice(nodes), rng.choice(nodes)) for _ in range(searches)]
+    h = ManhattanDistanceHeuristic(level).manhattan_distance
+
+    def generic():
+        for start, goal in pairs:
+            AStar(level.grid, h, NxNode(start), NxNode(goal)).pathfind()
+
+    def grid():
+        for start, goal in pairs:
+            GridAStar(level.grid, start, goal).pathfind()
+
+    generic_time = _timed(generic)
+    grid_time = _timed(grid)
+    return {
+        "searches": searches,
+        "generic_us_per_search": generic_time * 1e6 / searches,
+        "grid_us_per_search": grid_time * 1e6 / searches,
+        "speedup": generic_time / grid_time,
+    }
+
+
+def parallel(level: Level, worker_counts=(1, 2, 4, 8, 16)) -> Dict[str, float]:
+    """Time LC-MAE planning in different numbers of worker processes
+
+    The serial planner is timed too, as the baseline. Speedups are only
+    meaningful on maps much taller than the strips the planner splits them
+    into, since there are never more busy workers than strips in a phase,
+    and with at least as many cores as workers, which is why their number
+    is reported as well.
+    """
+    serial_time = _timed(lambda: lcmae.plan_evacuation(level, debug=False, sleep_radius=None))
+    result = {"cpus": float(os.cpu_count() or 1), "serial_time": serial_time}
+    for workers in worker_counts:
+        time = _timed(lambda: lcmae.plan_evacuation_parallel(level, workers, debug=False))
+        result[f"time_{workers}_workers"] = time
+        result[f"speedup_{workers}_workers"] = serial_time / time
+    return result
+
+
+def _timed(f: Callable) -> float:
+    start = perf_counter()
+    f()
+    return perf_counter() - start
+
+
+BENCHMARKS: Dict[str, Callable[[Level], Dict[str, float]]] = {
+    "reservations": reservations,
+    "search": search,
+    "parallel": parallel,
+}
@@ -0,0 +1,52 @@
+from evacsim.level import Level
+from evacsim.lcmae import PlanDelta, Planner
+from evacsim.lcmae.planner import agent_broke_deadlock
+
+
+def office() -> Level:
+    return Level("bench_suite/office.map", "bench_suite/office_r.scen")
+
+
+def collisions(paths):
+    """Return the timesteps in which two agents share a cell"""
+    found = []
+    for t in range(len(paths[0])):
+        cells = [path[t] for path in paths if path[t] >= 0]
+        if len(cells) != len(set(cells)):
+            found.append(t)
+    return found
+
+
+def plan(planner: Planner, ticks: int, paths):
+    for _ in range(ticks):
+        for path, pos in zip(paths, planner.step()):
+            path.append(pos)
+
+
+def test_removed_agent_moved_back_rejoins_in_current_timestep():
+    planner = Planner(office(), debug=False)
+    paths = [[pos] for pos in planner.positions()]
+    plan(planner, 5, paths)
+    planner.update(PlanDelta(removed=[0]))
+    for path, pos in zip(paths, planner.positions()):
+        path[-1] = pos
+    plan(planner, 10, paths)
+    free = next(cell for cell in range(planner.level.grid.size)
+                if planner.level.grid.passable[cell] and cell not in planner.positions())
+    planner.observe([free] + planner.positions()[1:])
+    assert planner.agents[0].pos.t == planner.t
+    assert planner.positions()[0] == free
+    for path, pos in zip(paths, planner.positions()):
+        path[-1] = pos
+    while not planner.finished:
+        plan(planner, 1, paths)
+    assert collisions(paths) == []
+
+
+def test_any_move_counts_as_progress_without_spreading_danger():
+    # Near the end, only safe agents move for a few timesteps
+    planner = Planner(Level("bench_suite/office.map", "bench_suite/office_half.scen"), debug=False, sleep_radius=None)
+    while not planner.finished:
+        planner.step()
+        if any(map(agent_broke_deadlock, planner.safe + planner.endangered)):
+            assert planner.deadlock_timer == 0
@@ -0,0 +1,19 @@
+from collections import Counter
+
+from evacsim.level import Level
+from evacsim.lcmae import plan_evacuation, rra
+
+
+def test_static_targets_are_searched_once(monkeypatch):
+    builds: Counter = Counter()
+    build = rra.RRATable.__init__
+
+    def counting_build(self, level, goal):
+        builds[goal] += 1
+        build(self, level, goal)
+
+    monkeypatch.setattr(rra.RRATable, "__init__", counting_build)
+    level = Level("bench_suite/concert.map", "bench_suite/concert_staticcrowd.scen")
+    plan_evacuation(level, debug=False)
+    assert builds
+    assert set(builds.values()) == {1}